@@ -1,6 +1,6 @@
 {
     'name': 'Plan de réapprovisionnement',
-    'version': '15.0.1.0.0',
+    'version': '15.0.1.2.0',
     'category': 'Inventory',
     'summary': 'Gestion des plans de réapprovisionnement',
     'description': """
@@ -17,12 +17,15 @@
     'data': [
         'security/ir.model.access.csv',
         'data/ir_sequence_data.xml',
+        'data/ir_cron_data.xml',
         'views/root_menu.xml',
         'reports/replen_plan_report.xml',
         'reports/replen_plan_tracking_report.xml',
         'views/replen_plan_views.xml',
         'views/replen_plan_confirm_views.xml',
         'views/replen_plan_tracking_views.xml',
+        'views/replen_plan_sales_history_views.xml',
+        'views/replen_plan_job_views.xml',
         'views/menu_views.xml',
     ],
     'images': ['static/description/icon.png'],
@@ -0,0 +1,8 @@
+def migrate(cr, version):
+    # Alimentation du lien inverse des lignes de commande vers les lignes de suivi existantes
+    cr.execute("""
+        UPDATE purchase_order_line pol
+        SET replen_tracking_line_id = rel.replen_plan_tracking_line_id
+        FROM purchase_order_line_replen_plan_tracking_line_rel rel
+        WHERE rel.purchase_order_line_id = pol.id
+    """)
@@ -0,0 +1,10 @@
+def migrate(cr, version):
+    # Rattachement des demandes de prix existantes à leur plan à partir de l'origine
+    cr.execute("""
+        INSERT INTO replen_plan_purchase_order_rel (plan_id, purchase_order_id)
+        SELECT rp.id, po.id
+        FROM replen_plan rp
+        JOIN purchase_order po ON po.origin = 'Réappro ' || rp.name
+        WHERE rp.state = 'done'
+        ON CONFLICT DO NOTHING
+    """)
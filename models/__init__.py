@@ -1,2 +1,4 @@
 from . import replen_plan
-from . import replen_plan_tracking 
\ No newline at end of file
+from . import replen_plan_tracking
+from . import replen_plan_sales_history
+from . import replen_plan_job
@@ -1,12 +1,27 @@
 from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import float_compare, float_round
+from collections import defaultdict
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
+from .replen_plan_simulation import ReplenPlanSimulator
+from .replen_plan_forecast_engine import FORECAST_METHODS, forecast_series
 import base64
 import logging
 
 _logger = logging.getLogger(__name__)
 
+try:
+    import numpy as np
+except ImportError:
+    _logger.debug("Impossible d'importer numpy : le moteur matriciel sera indisponible")
+    np = None
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
 class ReplenPlanLine(models.Model):
     _name = 'replen.plan.line'
     _description = 'Ligne de prévision'
@@ -17,6 +32,20 @@ class ReplenPlanLine(models.Model):
     date_display = fields.Char('Période', compute='_compute_date_display', store=True)
     historic_qty = fields.Float('Historique des ventes (par mois)', readonly=True)
     forecast_qty = fields.Float('Prévisions (par mois)')
+    forecast_method = fields.Selection(
+        FORECAST_METHODS,
+        string='Méthode de prévision',
+        readonly=True,
+        copy=False,
+        help="Méthode statistique retenue lors du dernier calcul automatique des prévisions"
+    )
+    is_dirty = fields.Boolean(
+        'À régénérer',
+        default=True,
+        copy=False,
+        readonly=True,
+        help="La prévision a changé depuis la dernière génération du plan"
+    )
 
     @api.depends('date')
     def _compute_date_display(self):
@@ -33,6 +62,15 @@ class ReplenPlanLine(models.Model):
             else:
                 line.date_display = ""
 
+    def write(self, vals):
+        if 'forecast_qty' in vals and 'is_dirty' not in vals:
+            # Seuls les composants des prévisions modifiées seront recalculés
+            vals = dict(vals, is_dirty=True)
+        if 'forecast_qty' in vals and 'forecast_method' not in vals:
+            # Une prévision saisie ou copiée n'est plus issue du calcul statistique
+            vals = dict(vals, forecast_method=False)
+        return super(ReplenPlanLine, self).write(vals)
+
 class ReplenPlanSupplierLine(models.Model):
     _name = 'replen.plan.supplier.line'
     _description = 'Ligne de fournisseur pour réapprovisionnement'
@@ -49,6 +87,37 @@ class ReplenPlanSupplierLine(models.Model):
         for line in self:
             line.total_price = line.price * line.quantity
 
+    @api.model
+    def _reschedule_components(self, components):
+        """Recalcule les dates de lancement des composants en phase de rapport, dont le fournisseur
+        retenu a pu changer. Les autres phases les recalculent à la génération et à l'entrée en rapport."""
+        components = components.exists().filtered(lambda c: c.plan_id.state == 'report')
+        components._schedule_releases()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(ReplenPlanSupplierLine, self).create(vals_list)
+        self._reschedule_components(records.mapped('component_id'))
+        self.env['replen.plan.component.supplier.display']._refresh_plans(records.mapped('component_id.plan_id'))
+        return records
+
+    def write(self, vals):
+        components = self.mapped('component_id')
+        plans = components.mapped('plan_id')
+        res = super(ReplenPlanSupplierLine, self).write(vals)
+        if any(field in vals for field in ['component_id', 'delivery_lead_time']):
+            self._reschedule_components(components | self.mapped('component_id'))
+        self.env['replen.plan.component.supplier.display']._refresh_plans(plans | self.mapped('component_id.plan_id'))
+        return res
+
+    def unlink(self):
+        components = self.mapped('component_id')
+        plans = components.mapped('plan_id')
+        res = super(ReplenPlanSupplierLine, self).unlink()
+        self._reschedule_components(components)
+        self.env['replen.plan.component.supplier.display']._refresh_plans(plans)
+        return res
+
 class ReplenPlanComponent(models.Model):
     _name = 'replen.plan.component'
     _description = 'Ligne de réapprovisionnement des composants'
@@ -60,27 +129,41 @@ class ReplenPlanComponent(models.Model):
     forecast_consumption = fields.Float('Consommation prévisionnelle', digits='Product Unit of Measure')
     current_stock = fields.Float('Stock actuel', digits='Product Unit of Measure')
     safety_stock = fields.Float('Stock de sécurité', digits='Product Unit of Measure')
+    projected_stock = fields.Float(
+        'Stock projeté',
+        digits='Product Unit of Measure',
+        readonly=True,
+        help="Stock disponible en début de mois, compte tenu des consommations et "
+             "des réapprovisionnements suggérés pour les mois précédents"
+    )
     stock_state = fields.Selection([
         ('available', 'Disponible'),
         ('warning', 'À surveiller'),
         ('urgent', 'Urgence')
-    ], string='État', compute='_compute_stock_state', store=True)
+    ], string='État', readonly=True)
     quantity_to_supply = fields.Float(
         'Quantité à réapprovisionner',
-        compute='_compute_quantity_to_supply',
         digits='Product Unit of Measure',
-        store=True,
-        readonly=False,
         help="Quantité calculée automatiquement mais modifiable si nécessaire"
     )
     suggested_quantity = fields.Float(
         'Quantité suggérée',
-        compute='_compute_quantity_to_supply',
         digits='Product Unit of Measure',
-        store=True,
         readonly=True,
-        help="Quantité calculée automatiquement selon la formule standard"
+        help="Besoin net calculé mois par mois à partir du stock projeté"
+    )
+    release_date = fields.Date(
+        'Date de lancement',
+        readonly=True,
+        help="Date d'envoi de la demande de prix pour une réception en début de mois, "
+             "compte tenu du délai de livraison du fournisseur"
     )
+    release_wave = fields.Date(
+        'Vague de lancement',
+        readonly=True,
+        help="Semaine (lundi) au cours de laquelle la demande de prix doit être envoyée"
+    )
+    is_late_release = fields.Boolean('Lancement en retard', readonly=True)
     supplier_line_ids = fields.One2many('replen.plan.supplier.line', 'component_id', string='Lignes fournisseurs')
 
     @api.depends('date')
@@ -98,24 +181,129 @@ class ReplenPlanComponent(models.Model):
             else:
                 line.date_display = ""
 
-    @api.depends('current_stock', 'forecast_consumption', 'safety_stock')
-    def _compute_stock_state(self):
-        for record in self:
-            difference = record.current_stock - record.forecast_consumption
-            if difference > record.safety_stock:
-                record.stock_state = 'available'
-            elif difference == record.safety_stock:
-                record.stock_state = 'warning'
+    @api.model
+    def _net_requirements(self, current_stock, safety_stock, consumptions, precision_digits=None):
+        """Calcule les besoins nets d'une série mensuelle ordonnée d'un composant.
+
+        Le stock projeté est reporté d'un mois sur l'autre : le stock consommé un mois
+        n'est plus disponible le mois suivant, et la quantité suggérée est supposée reçue.
+        Retourne une liste de dictionnaires (un par mois) avec projected_stock,
+        stock_state et suggested_quantity.
+        """
+        if precision_digits is None:
+            precision_digits = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        results = []
+        projected = current_stock
+        for consumption in consumptions:
+            remaining = projected - consumption
+            comparison = float_compare(remaining, safety_stock, precision_digits=precision_digits)
+            if comparison > 0:
+                stock_state = 'available'
+            elif comparison == 0:
+                stock_state = 'warning'
             else:
-                record.stock_state = 'urgent'
+                stock_state = 'urgent'
+            suggested = safety_stock - remaining if comparison < 0 else 0.0
+            results.append({
+                'projected_stock': projected,
+                'stock_state': stock_state,
+                'suggested_quantity': suggested,
+            })
+            projected = remaining + suggested
+        return results
 
-    @api.depends('forecast_consumption', 'current_stock', 'safety_stock')
-    def _compute_quantity_to_supply(self):
-        for line in self:
-            calculated_qty = line.forecast_consumption - line.current_stock + line.safety_stock
-            line.suggested_quantity = calculated_qty
-            if not line.quantity_to_supply:
-                line.quantity_to_supply = calculated_qty
+    def _apply_netting(self, keep_overrides=True):
+        """Calcule en une passe les besoins nets de toutes les séries (plan, composant) des lignes.
+
+        Les résultats sont écrits en une seule requête pour toutes les lignes. Avec keep_overrides,
+        une quantité à réapprovisionner saisie manuellement (différente de la suggestion précédente)
+        est conservée.
+        """
+        if not self:
+            return
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        series = defaultdict(list)
+        for line in self.sorted(lambda l: l.date):
+            series[(line.plan_id.id, line.product_id.id)].append(line)
+
+        line_ids, projected_stocks, stock_states, suggested_quantities, quantities = [], [], [], [], []
+        changed_ids = []
+        for lines in series.values():
+            results = self._net_requirements(
+                lines[0].current_stock,
+                lines[0].safety_stock,
+                [line.forecast_consumption for line in lines],
+                precision_digits=precision
+            )
+            for line, result in zip(lines, results):
+                is_override = line.quantity_to_supply and float_compare(
+                    line.quantity_to_supply, line.suggested_quantity, precision_digits=precision) != 0
+                quantity = None
+                if not (keep_overrides and is_override):
+                    quantity = result['suggested_quantity']
+                    changed_ids.append(line.id)
+                line_ids.append(line.id)
+                projected_stocks.append(result['projected_stock'])
+                stock_states.append(result['stock_state'])
+                suggested_quantities.append(result['suggested_quantity'])
+                quantities.append(quantity)
+
+        # Une seule requête pour toutes les lignes : NULL conserve la quantité saisie manuellement
+        fnames = ['projected_stock', 'stock_state', 'suggested_quantity', 'quantity_to_supply']
+        self.flush(fnames)
+        self.env.cr.execute("""
+            UPDATE replen_plan_component comp
+               SET projected_stock = res.projected_stock,
+                   stock_state = res.stock_state,
+                   suggested_quantity = res.suggested_quantity,
+                   quantity_to_supply = COALESCE(res.quantity_to_supply, comp.quantity_to_supply),
+                   write_uid = %s,
+                   write_date = (now() at time zone 'UTC')
+              FROM unnest(%s::int[], %s::float8[], %s::varchar[], %s::float8[], %s::float8[])
+                   AS res(id, projected_stock, stock_state, suggested_quantity, quantity_to_supply)
+             WHERE comp.id = res.id
+        """, (self.env.uid, line_ids, projected_stocks, stock_states, suggested_quantities, quantities))
+        self.invalidate_cache(fnames + ['write_uid', 'write_date'], line_ids)
+
+        # Quantité et prix total des lignes fournisseur (champs calculés stockés) à recalculer
+        changed = self.browse(changed_ids)
+        changed.modified(['quantity_to_supply'])
+        self.env['replen.plan.supplier.line'].flush(['quantity', 'total_price'])
+        self.env['replen.plan.component.supplier.display']._refresh_plans(changed.mapped('plan_id'))
+
+    def _schedule_releases(self):
+        """Calcule en une passe les dates et vagues de lancement des lignes de composants.
+
+        Le besoin net d'un mois est décalé du délai de livraison du fournisseur retenu (le
+        premier fournisseur du composant) ; les dates de lancement sont regroupées par
+        semaine, les lancements déjà en retard étant ramenés à la semaine en cours.
+        """
+        if not self:
+            return
+        lead_times = {}
+        supplier_lines = self.env['replen.plan.supplier.line'].search_read(
+            [('component_id', 'in', self.ids)], ['component_id', 'delivery_lead_time'], order='id')
+        for supplier_line in supplier_lines:
+            lead_times.setdefault(supplier_line['component_id'][0], supplier_line['delivery_lead_time'] or 0)
+
+        today = fields.Date.context_today(self)
+        updates = defaultdict(list)
+        for line in self.read(['date', 'quantity_to_supply']):
+            if line['quantity_to_supply'] > 0:
+                release_date = line['date'] - relativedelta(days=lead_times.get(line['id'], 0))
+                wave = max(release_date, today)
+                wave -= relativedelta(days=wave.weekday())
+                key = (release_date, wave, release_date < today)
+            else:
+                key = (False, False, False)
+            updates[key].append(line['id'])
+
+        for (release_date, wave, is_late), line_ids in updates.items():
+            self.browse(line_ids).write({
+                'release_date': release_date,
+                'release_wave': wave,
+                'is_late_release': is_late,
+            })
 
     def action_reset_quantity_to_supply(self):
         """Réinitialise la quantité à réapprovisionner à la valeur suggérée"""
@@ -123,20 +311,70 @@ class ReplenPlanComponent(models.Model):
             record.quantity_to_supply = record.suggested_quantity
 
     @api.model
-    def create(self, vals):
-        res = super(ReplenPlanComponent, self).create(vals)
-        if res.product_id:
-            # Créer une ligne pour chaque fournisseur
-            supplier_lines = []
-            for seller in res.product_id.seller_ids:
-                supplier_lines.append({
-                    'component_id': res.id,
-                    'supplier_id': seller.name.id,
-                    'price': seller.price,
-                    'delivery_lead_time': seller.delay,
-                })
-            if supplier_lines:
-                self.env['replen.plan.supplier.line'].create(supplier_lines)
+    def _get_sellers_by_product(self, products):
+        """Retourne {product_id: [product.supplierinfo]} en une seule recherche des fournisseurs"""
+        sellers_by_template = defaultdict(list)
+        sellers = self.env['product.supplierinfo'].search([
+            ('product_tmpl_id', 'in', products.mapped('product_tmpl_id').ids)
+        ])
+        for seller in sellers:
+            sellers_by_template[seller.product_tmpl_id.id].append(seller)
+        return {product.id: sellers_by_template.get(product.product_tmpl_id.id, []) for product in products}
+
+    @api.model
+    def _prepare_supplier_line_vals(self, component_id, seller):
+        return {
+            'component_id': component_id,
+            'supplier_id': seller.name.id,
+            'price': seller.price,
+            'delivery_lead_time': seller.delay,
+        }
+
+    def _create_missing_supplier_lines(self):
+        """Crée en une fois les lignes des fournisseurs qui n'en ont pas encore pour les composants"""
+        supplier_lines = self.env['replen.plan.supplier.line'].search([('component_id', 'in', self.ids)])
+        existing = {
+            (line['component_id'], line['supplier_id'])
+            for line in supplier_lines.read(['component_id', 'supplier_id'], load=False)
+        }
+
+        sellers_by_product = self._get_sellers_by_product(self.mapped('product_id'))
+        missing_lines = []
+        for component in self:
+            for seller in sellers_by_product.get(component.product_id.id, []):
+                key = (component.id, seller.name.id)
+                if key not in existing:
+                    existing.add(key)
+                    missing_lines.append(self._prepare_supplier_line_vals(component.id, seller))
+
+        if missing_lines:
+            self.env['replen.plan.supplier.line'].create(missing_lines)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(ReplenPlanComponent, self).create(vals_list)
+
+        # Créer une ligne pour chaque fournisseur de chaque composant, en une seule fois
+        sellers_by_product = self._get_sellers_by_product(records.mapped('product_id'))
+        supplier_lines = [
+            self._prepare_supplier_line_vals(record.id, seller)
+            for record in records
+            for seller in sellers_by_product.get(record.product_id.id, [])
+        ]
+        if supplier_lines:
+            self.env['replen.plan.supplier.line'].create(supplier_lines)
+        return records
+
+    def write(self, vals):
+        res = super(ReplenPlanComponent, self).write(vals)
+        if any(field in vals for field in ['quantity_to_supply', 'product_id', 'plan_id']):
+            self.env['replen.plan.component.supplier.display']._refresh_plans(self.mapped('plan_id'))
+        return res
+
+    def unlink(self):
+        plans = self.mapped('plan_id')
+        res = super(ReplenPlanComponent, self).unlink()
+        self.env['replen.plan.component.supplier.display']._refresh_plans(plans)
         return res
 
 class ReplenPlanComponentSupplierDisplay(models.Model):
@@ -152,66 +390,134 @@ class ReplenPlanComponentSupplierDisplay(models.Model):
     price = fields.Float('Prix unitaire', readonly=True)
     total_price = fields.Float('Prix total', readonly=True)
     delivery_lead_time = fields.Integer('Délai de livraison (jours)', readonly=True)
-    expected_delivery_date = fields.Date('Date de réception prévue', compute='_compute_expected_delivery_date', store=False)
-    is_late_delivery = fields.Boolean('Livraison hors période', compute='_compute_expected_delivery_date', store=False)
-
-    @api.depends('delivery_lead_time', 'plan_id.date_start', 'plan_id.date_end')
-    def _compute_expected_delivery_date(self):
-        today = fields.Date.today()
-        for record in self:
-            record.expected_delivery_date = today + relativedelta(days=record.delivery_lead_time or 0)
-            record.is_late_delivery = False
-            if record.expected_delivery_date and record.plan_id.date_end:
-                record.is_late_delivery = record.expected_delivery_date > record.plan_id.date_end
+    expected_delivery_date = fields.Date('Date de réception prévue', readonly=True)
+    is_late_delivery = fields.Boolean('Livraison hors période', readonly=True)
+
+    # Requête d'agrégation des lignes fournisseur, filtrée ou non par plan
+    _aggregate_query = """
+        SELECT
+            MIN(sup.id) as id,
+            comp.plan_id as plan_id,
+            comp.product_id as product_id,
+            sup.supplier_id as supplier_id,
+            SUM(comp.quantity_to_supply) as quantity_to_supply,
+            sup.price as price,
+            SUM(sup.price * comp.quantity_to_supply) as total_price,
+            sup.delivery_lead_time as delivery_lead_time
+        FROM replen_plan_component comp
+        JOIN replen_plan_supplier_line sup ON sup.component_id = comp.id
+        {where}
+        GROUP BY comp.plan_id, comp.product_id, sup.supplier_id, sup.price, sup.delivery_lead_time
+    """
 
     def init(self):
+        # Table d'agrégats tenue à jour par plan, indexée pour les lectures d'un seul plan
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS replen_plan_component_supplier_agg (
+                id integer PRIMARY KEY,
+                plan_id integer NOT NULL,
+                product_id integer NOT NULL,
+                supplier_id integer NOT NULL,
+                quantity_to_supply double precision,
+                price double precision,
+                total_price double precision,
+                delivery_lead_time integer
+            )
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS replen_plan_component_supplier_agg_plan_id_idx
+            ON replen_plan_component_supplier_agg (plan_id)
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS replen_plan_component_supplier_agg_product_supplier_idx
+            ON replen_plan_component_supplier_agg (product_id, supplier_id)
+        """)
+        # Reconstruction complète à l'installation et à la mise à jour du module
+        self.env.cr.execute("DELETE FROM replen_plan_component_supplier_agg")
+        self.env.cr.execute(
+            "INSERT INTO replen_plan_component_supplier_agg " + self._aggregate_query.format(where='')
+        )
+        # La vue joint replen_plan, dont la table n'existe pas encore à la première installation :
+        # elle est alors créée par l'init du plan
+        if tools.table_exists(self.env.cr, 'replen_plan'):
+            self._create_view()
+
+    def _create_view(self):
+        """Crée la vue d'affichage sur la table d'agrégats, sans recalculer les agrégats"""
         tools.drop_view_if_exists(self.env.cr, self._table)
-        self.env.cr.execute('''
+        # La vue ne porte plus que le calcul des dates, qui dépend du jour courant
+        self.env.cr.execute("""
             CREATE OR REPLACE VIEW replen_plan_component_supplier_display AS (
                 SELECT
-                    MIN(sup.id) as id,
-                    comp.plan_id as plan_id,
-                    comp.product_id as product_id,
-                    sup.supplier_id as supplier_id,
-                    SUM(comp.quantity_to_supply) as quantity_to_supply,
-                    sup.price as price,
-                    SUM(sup.price * comp.quantity_to_supply) as total_price,
-                    sup.delivery_lead_time as delivery_lead_time
-                FROM replen_plan_component comp
-                JOIN replen_plan_supplier_line sup ON sup.component_id = comp.id
-                GROUP BY comp.plan_id, comp.product_id, sup.supplier_id, sup.price, sup.delivery_lead_time
+                    agg.id,
+                    agg.plan_id,
+                    agg.product_id,
+                    agg.supplier_id,
+                    agg.quantity_to_supply,
+                    agg.price,
+                    agg.total_price,
+                    agg.delivery_lead_time,
+                    CURRENT_DATE + COALESCE(agg.delivery_lead_time, 0) as expected_delivery_date,
+                    COALESCE(CURRENT_DATE + COALESCE(agg.delivery_lead_time, 0) > plan.date_end, FALSE) as is_late_delivery
+                FROM replen_plan_component_supplier_agg agg
+                JOIN replen_plan plan ON plan.id = agg.plan_id
             )
-        ''')
+        """)
+
+    @api.model
+    def _refresh_plans(self, plans, force=False):
+        """Recalcule les agrégats des plans donnés.
+
+        Seuls les plans en phase de rapport sont recalculés, sauf si force est vrai : les autres
+        phases n'affichent pas ces lignes, et l'entrée en phase de rapport force le recalcul.
+        """
+        if not force:
+            plans = plans.filtered(lambda p: p.state == 'report')
+        plan_ids = [plan_id for plan_id in plans.ids if isinstance(plan_id, int)]
+        if not plan_ids:
+            return
+        self.env['replen.plan.component'].flush(['plan_id', 'product_id', 'quantity_to_supply'])
+        self.env['replen.plan.supplier.line'].flush(['component_id', 'supplier_id', 'price', 'delivery_lead_time'])
+        self.env.cr.execute(
+            "DELETE FROM replen_plan_component_supplier_agg WHERE plan_id IN %s",
+            (tuple(plan_ids),)
+        )
+        self.env.cr.execute(
+            "INSERT INTO replen_plan_component_supplier_agg "
+            + self._aggregate_query.format(where='WHERE comp.plan_id IN %s'),
+            (tuple(plan_ids),)
+        )
+        self.invalidate_cache()
+        self.env['replen.plan'].invalidate_cache(['component_supplier_ids', 'has_late_deliveries'], plan_ids)
 
     def unlink(self):
-        """Supprime les lignes fournisseur correspondantes"""
+        """Supprime les lignes fournisseur correspondantes, pour tous les mois du composant"""
         if not self:
             return True
 
-        # Stocker les informations nécessaires avant la suppression
-        to_unlink_data = []
-        for record in self:
-            to_unlink_data.append({
-                'plan_id': record.plan_id.id,
-                'product_id': record.product_id.id,
-                'supplier_id': record.supplier_id.id
-            })
-
-        # Supprimer les lignes fournisseur pour chaque enregistrement
-        for data in to_unlink_data:
-            # Rechercher le composant correspondant
-            component = self.env['replen.plan.component'].search([
-                ('plan_id', '=', data['plan_id']),
-                ('product_id', '=', data['product_id'])
-            ], limit=1)
-            
-            if component:
-                # Supprimer la ligne fournisseur correspondante
-                supplier_lines = component.supplier_line_ids.filtered(
-                    lambda l: l.supplier_id.id == data['supplier_id']
-                )
-                if supplier_lines:
-                    supplier_lines.unlink()
+        # Couples (plan, produit, fournisseur) des lignes affichées, lus en une fois
+        keys = {
+            (row['plan_id'], row['product_id'], row['supplier_id'])
+            for row in self.read(['plan_id', 'product_id', 'supplier_id'], load=False)
+        }
+        plan_ids, product_ids, supplier_ids = (list(values) for values in zip(*keys))
+
+        # Résolution des lignes fournisseur correspondantes en une seule requête
+        self.env['replen.plan.component'].flush(['plan_id', 'product_id'])
+        self.env['replen.plan.supplier.line'].flush(['component_id', 'supplier_id'])
+        self.env.cr.execute("""
+            SELECT sup.id
+            FROM replen_plan_supplier_line sup
+            JOIN replen_plan_component comp ON comp.id = sup.component_id
+            JOIN unnest(%s::int[], %s::int[], %s::int[]) AS sel(plan_id, product_id, supplier_id)
+              ON sel.plan_id = comp.plan_id
+             AND sel.product_id = comp.product_id
+             AND sel.supplier_id = sup.supplier_id
+        """, (plan_ids, product_ids, supplier_ids))
+        supplier_line_ids = [row[0] for row in self.env.cr.fetchall()]
+
+        if supplier_line_ids:
+            self.env['replen.plan.supplier.line'].browse(supplier_line_ids).unlink()
         
         return True
 
@@ -310,9 +616,77 @@ class ReplenPlan(models.Model):
     has_late_deliveries = fields.Boolean(
         string='A des livraisons tardives',
         compute='_compute_has_late_deliveries',
+        search='_search_has_late_deliveries',
         store=False
     )
 
+    purchase_order_ids = fields.Many2many(
+        'purchase.order',
+        'replen_plan_purchase_order_rel',
+        'plan_id',
+        'purchase_order_id',
+        string='Demandes de prix',
+        copy=False,
+        readonly=True
+    )
+    purchase_order_count = fields.Integer(
+        string='Nombre de demandes de prix',
+        compute='_compute_purchase_order_count'
+    )
+
+    run_mode = fields.Selection([
+        ('sync', 'Immédiat'),
+        ('async', 'En arrière-plan')
+    ], string="Mode d'exécution", default='sync', required=True,
+        help="En arrière-plan, la création des prévisions, la génération du plan et celle des "
+             "demandes de prix sont traitées par lots par une tâche planifiée.")
+    job_id = fields.Many2one('replen.plan.job', string='Dernier traitement', readonly=True, copy=False)
+    job_state = fields.Selection(related='job_id.state', string='État du traitement')
+    job_type = fields.Selection(related='job_id.job_type', string='Traitement en cours')
+    job_progress = fields.Float(related='job_id.progress', string='Avancement du traitement')
+    job_eta = fields.Datetime(related='job_id.eta', string='Fin estimée du traitement')
+    job_can_cancel = fields.Boolean(related='job_id.can_cancel', string='Traitement annulable')
+
+    history_method = fields.Selection([
+        ('same_month', 'Même mois des N dernières années'),
+        ('trailing', 'N mois glissants'),
+        ('weighted', 'Moyenne pondérée des N dernières années')
+    ], string="Calcul de l'historique", default='same_month', required=True,
+        help="Même mois : moyenne du même mois sur les N dernières années. "
+             "Mois glissants : moyenne des N mois se terminant au même mois de l'année précédente. "
+             "Moyenne pondérée : même mois sur N ans, l'année la plus récente pesant le plus.")
+    history_years = fields.Integer("Années d'historique", default=1)
+    history_months = fields.Integer("Mois glissants", default=3)
+
+    forecast_history_months = fields.Integer(
+        'Historique des prévisions (mois)',
+        default=36,
+        help="Nombre de mois de ventes utilisés pour calculer les prévisions statistiques"
+    )
+
+    generation_engine = fields.Selection([
+        ('python', 'Standard'),
+        ('matrix', 'Matriciel (NumPy)')
+    ], string='Moteur de génération', default='python', required=True,
+        help="Le moteur matriciel calcule les besoins de tous les composants en une seule "
+             "multiplication de matrices, ce qui accélère la génération des plans volumineux.")
+
+    def init(self):
+        # Création de la vue d'affichage des fournisseurs, qui dépend de la table des plans ;
+        # la table d'agrégats a déjà été reconstruite par l'init de l'affichage
+        self.env['replen.plan.component.supplier.display']._create_view()
+
+    @api.constrains('history_years', 'history_months')
+    def _check_history_window(self):
+        for plan in self:
+            if plan.history_years < 1 or plan.history_months < 1:
+                raise ValidationError(_("La fenêtre d'historique doit couvrir au moins une année et un mois."))
+
+    @api.depends('purchase_order_ids')
+    def _compute_purchase_order_count(self):
+        for plan in self:
+            plan.purchase_order_count = len(plan.purchase_order_ids)
+
     @api.depends('product_ids')
     def _compute_product_count(self):
         for plan in self:
@@ -527,35 +901,46 @@ class ReplenPlan(models.Model):
     def _get_historic_sales(self, product_id, date):
         """Calcule les ventes historiques pour un produit à une date donnée"""
         self.ensure_one()
-        
-        # Calculer la même période l'année précédente
-        start_date = date.replace(year=date.year - 1)
-        end_date = (start_date + relativedelta(months=1, days=-1))
-        
-        _logger.info(f"Calcul historique pour le produit {product_id}:")
-        _logger.info(f"Période: du {start_date} au {end_date}")
-        
-        # Rechercher les mouvements de stock sortants (livraisons)
-        domain = [
-            ('product_id', '=', product_id),
-            ('state', '=', 'done'),
-            ('date', '>=', start_date),
-            ('date', '<=', end_date),
-            ('location_dest_id.usage', '=', 'customer'),  # Livraisons aux clients
-        ]
-        
-        _logger.info(f"Domaine de recherche: {domain}")
-        
-        moves = self.env['stock.move'].search(domain)
-        _logger.info(f"Mouvements trouvés: {len(moves)}")
-        
-        for move in moves:
-            _logger.info(f"Mouvement: {move.name} - Quantité: {move.product_uom_qty} - Date: {move.date}")
-        
-        total_qty = sum(moves.mapped('product_uom_qty'))
-        _logger.info(f"Quantité totale: {total_qty}")
-        
-        return total_qty
+        month_date = date.replace(day=1)
+        historic = self._get_historic_sales_bulk([product_id], [month_date])
+        return historic.get((product_id, month_date), 0.0)
+
+    def _get_history_window(self):
+        """Retourne les décalages (en mois) et les poids de la fenêtre d'historique du plan"""
+        self.ensure_one()
+        if self.history_method == 'trailing':
+            # Les N mois se terminant au même mois de l'année précédente
+            offsets = [12 + index for index in range(self.history_months)]
+            weights = [1.0] * len(offsets)
+        else:
+            # Le même mois sur les N dernières années
+            offsets = [12 * (index + 1) for index in range(self.history_years)]
+            if self.history_method == 'weighted':
+                # L'année la plus récente a le poids le plus fort
+                weights = [float(self.history_years - index) for index in range(self.history_years)]
+            else:
+                weights = [1.0] * len(offsets)
+        return offsets, weights
+
+    def _get_historic_sales_bulk(self, product_ids, months):
+        """Calcule en une seule requête les ventes historiques de tous les couples (produit, mois).
+
+        L'historique d'un mois est agrégé sur la fenêtre paramétrée sur le plan (même mois
+        sur N ans, N mois glissants ou moyenne pondérée). Retourne un dictionnaire
+        {(product_id, mois): quantité}.
+        """
+        self.ensure_one()
+        if not product_ids or not months:
+            return {}
+
+        # Lecture depuis le cube mensuel des ventes plutôt que depuis les mouvements de stock,
+        # limitée aux sociétés actives de l'utilisateur
+        offsets, weights = self._get_history_window()
+        historic = self.env['replen.plan.sales.history']._get_windowed_sales(
+            product_ids, months, offsets, self.env.companies.ids, weights=weights)
+
+        _logger.info(f"Historique calculé pour {len(product_ids)} produit(s) sur {len(months)} mois")
+        return historic
 
     @api.depends('line_ids.forecast_qty')
     def _compute_has_empty_forecasts(self):
@@ -585,6 +970,7 @@ class ReplenPlan(models.Model):
 
     def action_to_forecast(self):
         self.ensure_one()
+        self._check_no_pending_job()
         _logger.info(f"Transition vers l'état forecast pour le plan {self.name}")
         
         if not self.product_ids:
@@ -598,40 +984,46 @@ class ReplenPlan(models.Model):
 
         _logger.info(f"Période: {self.period_type} - Sous-période: {self.sub_period}")
 
+        if self.run_mode == 'async':
+            return self._enqueue_job('forecast')
+
         # Création des lignes de prévision
         months = self._get_months_in_period()
         _logger.info(f"Mois dans la période: {months}")
+
+        _logger.info(f"Suppression des anciennes lignes")
+        # Suppression des anciennes lignes si elles existent, composants compris :
+        # la prochaine génération repart de zéro
+        self.line_ids.unlink()
+        self.component_ids.unlink()
+
+        # Création des nouvelles lignes
+        self._create_forecast_lines(self.product_ids, months)
+            
+        # Passage à l'état 'forecast'
+        self.write({'state': 'forecast'})
         
+        return self._return_form_action('forecast')
+
+    def _create_forecast_lines(self, products, months):
+        """Crée les lignes de prévision des produits donnés pour tous les mois de la période"""
+        self.ensure_one()
+        # Calcul de l'historique de tous les produits et de tous les mois en une seule requête
+        historic = self._get_historic_sales_bulk(products.ids, months)
+
         lines_to_create = []
-        
-        for product in self.product_ids:
-            _logger.info(f"\nTraitement du produit: {product.name}")
+        for product in products:
             for month_date in months:
-                _logger.info(f"Calcul pour le mois: {month_date}")
-                # Calculer l'historique des ventes pour ce produit et ce mois
-                historic_qty = self._get_historic_sales(product.id, month_date)
-                _logger.info(f"Quantité historique calculée: {historic_qty}")
-                
                 lines_to_create.append({
                     'plan_id': self.id,
                     'product_id': product.id,
                     'date': month_date,
-                    'historic_qty': historic_qty,
+                    'historic_qty': historic.get((product.id, month_date), 0.0),
                     'forecast_qty': 0.0,
                 })
-        
-        _logger.info(f"Suppression des anciennes lignes")
-        # Suppression des anciennes lignes si elles existent
-        self.line_ids.unlink()
-        
+
         _logger.info(f"Création de {len(lines_to_create)} nouvelles lignes")
-        # Création des nouvelles lignes
-        self.env['replen.plan.line'].create(lines_to_create)
-            
-        # Passage à l'état 'forecast'
-        self.write({'state': 'forecast'})
-        
-        return self._return_form_action('forecast')
+        return self.env['replen.plan.line'].create(lines_to_create)
 
     def action_generate_plan(self):
         self.ensure_one()
@@ -646,88 +1038,332 @@ class ReplenPlan(models.Model):
                 'res_model': 'replen.plan.confirm.wizard',
                 'view_mode': 'form',
                 'target': 'new',
-                'context': {'default_plan_id': self.id}
+                'context': {
+                    'default_plan_id': self.id,
+                    'replen_full_regeneration': self.env.context.get('replen_full_regeneration', False),
+                }
             }
         else:
             return self._generate_plan()
 
-    def _get_bom_components(self, product, qty, level=0, component_needs=None, month_date=None):
-        """Récupère récursivement tous les composants d'un produit, y compris les sous-assemblages"""
+    def _get_bom_map(self, products):
+        """Recherche les nomenclatures des produits et de tous leurs sous-composants.
+
+        Un seul appel à _bom_find est fait par niveau de nomenclature.
+        Retourne un dictionnaire {product_id: mrp.bom}.
+        """
+        bom_map = {}
+        to_process = products
+        while to_process:
+            boms = self.env['mrp.bom']._bom_find(to_process)
+            next_products = self.env['product.product']
+            for product in to_process:
+                bom = boms.get(product) if boms else False
+                bom_map[product.id] = bom
+                if bom and bom.bom_line_ids:
+                    next_products |= bom.bom_line_ids.mapped('product_id')
+            to_process = next_products.filtered(lambda p: p.id not in bom_map)
+        return bom_map
+
+    def _get_flattened_boms(self, products):
+        """Aplatit les nomenclatures des produits, sous-assemblages compris.
+
+        Retourne un dictionnaire {product_id: {component_id: quantité cumulée par unité}}
+        ne contenant que les composants finaux. Le résultat est calculé une fois par
+        génération de plan et partagé entre tous les mois et tous les produits finis.
+        """
+        bom_map = self._get_bom_map(products)
+        flattened = {}
+        in_progress = set()
+
+        def flatten(product_id):
+            if product_id in flattened:
+                return flattened[product_id]
+            # Protection contre les boucles : un produit déjà en cours d'aplatissement
+            # n'est pas redéveloppé, et ce résultat partiel n'est pas mémorisé
+            if product_id in in_progress:
+                _logger.warning(f"Boucle de nomenclature détectée sur le produit {product_id}")
+                return {}
+            in_progress.add(product_id)
+            leaves = {}
+            bom = bom_map.get(product_id)
+            if bom and bom.bom_line_ids:
+                for bom_line in bom.bom_line_ids:
+                    component_id = bom_line.product_id.id
+                    sub_bom = bom_map.get(component_id)
+                    if sub_bom and sub_bom.bom_line_ids:
+                        # Sous-assemblage ou kit : on reprend ses composants finaux
+                        for leaf_id, leaf_qty in flatten(component_id).items():
+                            leaves[leaf_id] = leaves.get(leaf_id, 0.0) + bom_line.product_qty * leaf_qty
+                    else:
+                        leaves[component_id] = leaves.get(component_id, 0.0) + bom_line.product_qty
+            in_progress.discard(product_id)
+            flattened[product_id] = leaves
+            return leaves
+
+        for product in products:
+            flatten(product.id)
+        return flattened
+
+    def _prepare_component_need(self, component_id):
+        """Initialise les besoins d'un composant final.
+
+        Le stock actuel et le stock de sécurité sont renseignés ensuite pour tous les
+        composants à la fois par _get_component_stock_data.
+        """
+        return {
+            'product': self.env['product.product'].browse(component_id),
+            'current_stock': 0.0,
+            'safety_stock': 0.0,
+            'monthly_data': {}
+        }
+
+    def _get_component_stock_data(self, component_ids):
+        """Récupère en deux requêtes groupées le stock actuel et le stock de sécurité des composants.
+
+        Retourne un dictionnaire {component_id: (stock actuel, stock de sécurité)}.
+        """
+        if not component_ids:
+            return {}
+
+        # Stock actuel : quants des emplacements internes regroupés par produit
+        quant_groups = self.env['stock.quant'].read_group(
+            [('product_id', 'in', component_ids), ('location_id.usage', '=', 'internal')],
+            ['product_id', 'quantity:sum'],
+            ['product_id'],
+            lazy=False
+        )
+        current_stocks = {group['product_id'][0]: group['quantity'] for group in quant_groups}
+
+        # Stock de sécurité : quantités minimales des règles de stock des emplacements internes
+        orderpoint_groups = self.env['stock.warehouse.orderpoint'].read_group(
+            [('product_id', 'in', component_ids), ('location_id.usage', '=', 'internal')],
+            ['product_id', 'product_min_qty:sum'],
+            ['product_id'],
+            lazy=False
+        )
+        safety_stocks = {group['product_id'][0]: group['product_min_qty'] for group in orderpoint_groups}
+
+        return {
+            component_id: (current_stocks.get(component_id, 0.0), safety_stocks.get(component_id, 0.0))
+            for component_id in component_ids
+        }
+
+    def _get_bom_components(self, product, qty, component_needs=None, month_date=None, flat_boms=None):
+        """Ajoute aux besoins les composants finaux d'un produit à partir des nomenclatures aplaties"""
         if component_needs is None:
             component_needs = {}
-        if level > 10:  # Protection contre les boucles infinies
-            return component_needs
+        if flat_boms is None:
+            flat_boms = self._get_flattened_boms(product)
 
-        # Récupérer la nomenclature spécifique à la variante
-        boms = self.env['mrp.bom']._bom_find(product)
-        if not boms or not boms.get(product):
-            return component_needs
-            
-        bom = boms[product]
-        if not bom or not bom.bom_line_ids:
-            return component_needs
-
-        # Pour chaque composant dans la nomenclature
-        for bom_line in bom.bom_line_ids:
-            component = bom_line.product_id
-            qty_needed = bom_line.product_qty * qty
-
-            # Si le composant a une nomenclature (sous-assemblage ou kit)
-            sub_boms = self.env['mrp.bom']._bom_find(component)
-            sub_bom = sub_boms.get(component) if sub_boms else False
-            
-            if sub_bom and sub_bom.bom_line_ids:
-                # Récursion pour obtenir les composants du sous-assemblage
-                self._get_bom_components(component, qty_needed, level + 1, component_needs, month_date)
-            else:
-                # C'est un composant final
-                if component.id not in component_needs:
-                    # Récupérer le stock actuel
-                    current_stock = component.qty_available
-
-                    # Récupérer le stock de sécurité depuis les règles de stock
-                    orderpoint = self.env['stock.warehouse.orderpoint'].search([
-                        ('product_id', '=', component.id),
-                        ('location_id.usage', '=', 'internal')
-                    ], limit=1)
-                    safety_stock = orderpoint.product_min_qty if orderpoint else 0.0
-
-                    component_needs[component.id] = {
-                        'product': component,
-                        'current_stock': current_stock,
-                        'safety_stock': safety_stock,
-                        'monthly_data': {}
-                    }
-
-                # Ajouter les besoins pour ce mois
-                if month_date not in component_needs[component.id]['monthly_data']:
-                    component_needs[component.id]['monthly_data'][month_date] = {'qty': 0}
-                component_needs[component.id]['monthly_data'][month_date]['qty'] += qty_needed
+        for component_id, unit_qty in flat_boms.get(product.id, {}).items():
+            if component_id not in component_needs:
+                component_needs[component_id] = self._prepare_component_need(component_id)
+
+            # Ajouter les besoins pour ce mois
+            monthly_data = component_needs[component_id]['monthly_data']
+            if month_date not in monthly_data:
+                monthly_data[month_date] = {'qty': 0}
+            monthly_data[month_date]['qty'] += unit_qty * qty
 
         return component_needs
 
+    def _get_component_needs_matrix(self, flat_boms, lines=None):
+        """Calcule les besoins de tous les composants par un produit matriciel.
+
+        Les prévisions forment une matrice produits × mois et les nomenclatures aplaties une
+        matrice creuse produits × composants : les besoins composants × mois s'obtiennent en
+        une seule multiplication. Le résultat a la même structure que celui de _get_bom_components.
+        """
+        self.ensure_one()
+        if np is None:
+            raise UserError(_("Le moteur de génération matriciel nécessite la bibliothèque Python NumPy."))
+
+        if lines is None:
+            lines = self.line_ids
+        forecasts = lines.read(['product_id', 'date', 'forecast_qty'], load=False)
+        product_ids = sorted({row['product_id'] for row in forecasts})
+        month_list = sorted({row['date'] for row in forecasts})
+        component_ids = sorted({component_id for product_id in product_ids
+                                for component_id in flat_boms.get(product_id, {})})
+        if not component_ids:
+            return {}
+
+        product_index = {product_id: index for index, product_id in enumerate(product_ids)}
+        month_index = {month: index for index, month in enumerate(month_list)}
+        component_index = {component_id: index for index, component_id in enumerate(component_ids)}
+
+        # Matrices produits × mois : quantités prévues et présence d'une ligne de prévision
+        forecast_matrix = np.zeros((len(product_ids), len(month_list)))
+        presence_matrix = np.zeros((len(product_ids), len(month_list)))
+        for row in forecasts:
+            position = (product_index[row['product_id']], month_index[row['date']])
+            forecast_matrix[position] += row['forecast_qty']
+            presence_matrix[position] = 1.0
+
+        # Matrice produits × composants des quantités par unité (et de leur présence)
+        bom_rows, bom_cols, bom_qty = [], [], []
+        for product_id in product_ids:
+            for component_id, unit_qty in flat_boms.get(product_id, {}).items():
+                bom_rows.append(product_index[product_id])
+                bom_cols.append(component_index[component_id])
+                bom_qty.append(unit_qty)
+        shape = (len(product_ids), len(component_ids))
+        if sparse is not None:
+            bom_matrix = sparse.csr_matrix((bom_qty, (bom_rows, bom_cols)), shape=shape)
+            structure_matrix = sparse.csr_matrix((np.ones(len(bom_qty)), (bom_rows, bom_cols)), shape=shape)
+        else:
+            bom_matrix = np.zeros(shape)
+            structure_matrix = np.zeros(shape)
+            np.add.at(bom_matrix, (bom_rows, bom_cols), bom_qty)
+            structure_matrix[bom_rows, bom_cols] = 1.0
+
+        # Besoins composants × mois, et couples (composant, mois) concernés par au moins une prévision
+        needs_matrix = np.asarray(bom_matrix.T @ forecast_matrix)
+        used_matrix = np.asarray(structure_matrix.T @ presence_matrix) > 0
+
+        component_needs = {}
+        for comp_pos, month_pos in zip(*np.nonzero(used_matrix)):
+            component_id = component_ids[comp_pos]
+            if component_id not in component_needs:
+                component_needs[component_id] = self._prepare_component_need(component_id)
+            component_needs[component_id]['monthly_data'][month_list[month_pos]] = {
+                'qty': float(needs_matrix[comp_pos, month_pos])
+            }
+        return component_needs
+
     def _generate_plan(self):
         self.ensure_one()
+        self._check_no_pending_job()
+
+        # Plan déjà généré : seuls les composants des prévisions modifiées sont recalculés
+        incremental = self.component_ids and not self.env.context.get('replen_full_regeneration')
+        if self.run_mode == 'async':
+            return self._enqueue_job('regenerate' if incremental else 'generate')
+
+        if incremental:
+            self._regenerate_dirty_components()
+            self.write({'state': 'plan'})
+            return self._return_form_action('plan')
 
         # Supprimer les anciennes lignes de composants
         self.component_ids.unlink()
 
+        # Nomenclatures aplaties une seule fois pour toute la génération
+        flat_boms = self._get_flattened_boms(self.line_ids.mapped('product_id'))
+        self._create_component_lines(self._compute_component_needs(flat_boms))
+        self.line_ids.filtered('is_dirty').write({'is_dirty': False})
+
+        # Passage à l'état 'plan'
+        self.write({'state': 'plan'})
+        return self._return_form_action('plan')
+
+    def action_generate_plan_full(self):
+        """Régénère tout le plan, par exemple après une modification des nomenclatures ou du stock"""
+        return self.with_context(replen_full_regeneration=True).action_generate_plan()
+
+    @api.model
+    def _get_where_used_index(self, flat_boms):
+        """Inverse les nomenclatures aplaties : {component_id: {product_id: quantité par unité}}"""
+        where_used = defaultdict(dict)
+        for product_id, leaves in flat_boms.items():
+            for component_id, unit_qty in leaves.items():
+                where_used[component_id][product_id] = unit_qty
+        return where_used
+
+    def _regenerate_dirty_components(self):
+        """Recalcule uniquement les composants des prévisions modifiées depuis la dernière génération.
+
+        Les lignes de composants existantes sont mises à jour sur place : leurs lignes fournisseur
+        et les quantités à réapprovisionner saisies manuellement sont conservées.
+        """
+        self.ensure_one()
+        dirty_lines = self.line_ids.filtered('is_dirty')
+        if not dirty_lines:
+            return
+
+        flat_boms = self._get_flattened_boms(self.line_ids.mapped('product_id'))
+        where_used = self._get_where_used_index(flat_boms)
+
+        # Composants touchés par les prévisions modifiées, et produits finis qui les consomment
+        affected_ids = {component_id
+                        for product_id in dirty_lines.mapped('product_id').ids
+                        for component_id in flat_boms.get(product_id, {})}
+        product_ids = {product_id for component_id in affected_ids for product_id in where_used[component_id]}
+        restricted_boms = {
+            product_id: {component_id: qty for component_id, qty in flat_boms[product_id].items() if component_id in affected_ids}
+            for product_id in product_ids
+        }
+        lines = self.line_ids.filtered(lambda l: l.product_id.id in product_ids)
+        component_needs = self._compute_component_needs(restricted_boms, lines=lines)
+
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        Component = self.env['replen.plan.component']
+        existing = self.component_ids.filtered(lambda c: c.product_id.id in affected_ids)
+        existing_by_key = {(component.product_id.id, component.date): component for component in existing}
+
+        consumption_updates = defaultdict(list)
+        new_needs = {}
+        for component_id, data in component_needs.items():
+            for month_date, month_data in data['monthly_data'].items():
+                component = existing_by_key.pop((component_id, month_date), None)
+                if component is None:
+                    if component_id not in new_needs:
+                        new_needs[component_id] = self._prepare_component_need(component_id)
+                    new_needs[component_id]['monthly_data'][month_date] = month_data
+                elif float_compare(component.forecast_consumption, month_data['qty'], precision_digits=precision) != 0:
+                    consumption_updates[month_data['qty']].append(component.id)
+
+        # Mois qui ne sont plus consommés par aucune prévision
+        obsolete = Component.browse([component.id for component in existing_by_key.values()])
+        obsolete.unlink()
+        for qty, component_ids in consumption_updates.items():
+            Component.browse(component_ids).write({'forecast_consumption': qty})
+        if new_needs:
+            self._create_component_lines(new_needs)
+
+        # Besoins nets et lancements recalculés sur les séries complètes des composants touchés
+        affected = self.component_ids.filtered(lambda c: c.product_id.id in affected_ids)
+        affected._apply_netting(keep_overrides=True)
+        affected._schedule_releases()
+
+        dirty_lines.write({'is_dirty': False})
+        _logger.info(f"Plan {self.name} : {len(affected_ids)} composant(s) recalculé(s) "
+                     f"pour {len(dirty_lines)} prévision(s) modifiée(s)")
+
+    def _compute_component_needs(self, flat_boms, lines=None):
+        """Calcule les besoins des composants finaux présents dans flat_boms avec le moteur du plan.
+
+        Par défaut toutes les prévisions du plan sont prises en compte, sinon seulement lines.
+        """
+        self.ensure_one()
+        if lines is None:
+            lines = self.line_ids
+        if self.generation_engine == 'matrix':
+            return self._get_component_needs_matrix(flat_boms, lines=lines)
+
         # Dictionnaire pour accumuler les besoins par composant et par mois
         component_needs = {}
 
         # Pour chaque produit fini et ses prévisions
-        for line in self.line_ids:
-            product = line.product_id
-            forecast_qty = line.forecast_qty
-            month_date = line.date
-
-            # Récupérer tous les composants de manière récursive
-            component_needs = self._get_bom_components(
-                product, 
-                forecast_qty, 
+        for line in lines:
+            self._get_bom_components(
+                line.product_id,
+                line.forecast_qty,
                 component_needs=component_needs,
-                month_date=month_date
+                month_date=line.date,
+                flat_boms=flat_boms
             )
+        return component_needs
+
+    def _create_component_lines(self, component_needs):
+        """Crée les lignes de composants à partir des besoins, puis calcule besoins nets et lancements"""
+        self.ensure_one()
+        # Stock actuel et stock de sécurité de tous les composants finaux en une fois
+        stock_data = self._get_component_stock_data(list(component_needs))
+        for comp_id, (current_stock, safety_stock) in stock_data.items():
+            component_needs[comp_id]['current_stock'] = current_stock
+            component_needs[comp_id]['safety_stock'] = safety_stock
 
         # Créer les lignes de composants
         component_lines = []
@@ -742,119 +1378,185 @@ class ReplenPlan(models.Model):
                     'safety_stock': data['safety_stock'],
                 })
 
+        components = self.env['replen.plan.component']
         if component_lines:
-            self.env['replen.plan.component'].create(component_lines)
-
-        # Passage à l'état 'plan'
-        self.write({'state': 'plan'})
-        return self._return_form_action('plan')
+            components = components.create(component_lines)
+            # Besoins nets calculés mois par mois sur le stock projeté
+            components._apply_netting(keep_overrides=False)
+            # Dates de lancement des demandes de prix selon les délais fournisseurs
+            components._schedule_releases()
+        return components
 
     def action_back_to_draft(self):
         self.ensure_one()
+        self._check_no_pending_job()
         self.write({'state': 'draft'})
         return self._return_form_action('draft')
 
     def action_back_to_forecast(self):
         self.ensure_one()
+        self._check_no_pending_job()
         self.write({'state': 'forecast'})
         return self._return_form_action('forecast')
 
     def action_back_to_plan(self):
         self.ensure_one()
+        self._check_no_pending_job()
         self.write({'state': 'plan'})
         return self._return_form_action('plan')
 
     def action_to_report(self):
         self.ensure_one()
+        self._check_no_pending_job()
         
-        # Force le recalcul des fournisseurs disponibles
-        for component in self.component_ids:
-            # Recalcul des quantités
-            component._compute_quantity_to_supply()
-            
-            # Réinitialisation des lignes fournisseurs
-            existing_suppliers = component.supplier_line_ids.mapped('supplier_id')
-            for seller in component.product_id.seller_ids:
-                if seller.name not in existing_suppliers:
-                    self.env['replen.plan.supplier.line'].create({
-                        'component_id': component.id,
-                        'supplier_id': seller.name.id,
-                        'price': seller.price,
-                        'delivery_lead_time': seller.delay,
-                    })
-            
+        # Recalcul des besoins nets en conservant les quantités saisies manuellement
+        self.component_ids._apply_netting()
+
+        # Ajout des fournisseurs disponibles qui n'ont pas encore de ligne
+        self.component_ids._create_missing_supplier_lines()
+
+        # Les fournisseurs ayant pu changer, les dates de lancement sont recalculées
+        self.component_ids._schedule_releases()
+
         self.write({'state': 'report'})
         return self._return_form_action('report')
 
     def action_generate_rfq(self):
         self.ensure_one()
+        self._check_no_pending_job()
+        if self.run_mode == 'async':
+            return self._enqueue_job('rfq')
 
-        # Grouper les composants par fournisseur
-        supplier_products = {}
-        rfq_count = 0
-        components_with_rfq = []  # Liste pour suivre les composants avec demande de prix
+        purchase_orders = self._create_rfqs()
+        self._finalize_rfq()
+        rfq_count = len(purchase_orders)
 
-        for component in self.component_ids:
+        # Message de notification avec redirection
+        message = _('{} demande(s) de prix ont été générée(s) avec succès.').format(rfq_count)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Succès'),
+                'message': message,
+                'sticky': False,
+                'type': 'success',
+                'next': self._return_form_action('done'),
+            },
+        }
+
+    def _get_rfq_supplier_products(self):
+        """Regroupe par fournisseur les lignes à commander.
+
+        Retourne les composants ayant des lignes fournisseur et {supplier_id: [lignes]}.
+        """
+        self.ensure_one()
+        supplier_products = defaultdict(list)
+        components_with_rfq = self.component_ids.filtered('supplier_line_ids')
+
+        for component in components_with_rfq:
             for supplier_line in component.supplier_line_ids:
-                if supplier_line.supplier_id not in supplier_products:
-                    supplier_products[supplier_line.supplier_id] = []
-                    rfq_count += 1
-                supplier_products[supplier_line.supplier_id].append({
+                supplier_products[supplier_line.supplier_id.id].append({
                     'product_id': component.product_id.id,
                     'quantity': component.quantity_to_supply,
                     'price_unit': supplier_line.price,
                 })
-                if component not in components_with_rfq:
-                    components_with_rfq.append(component)
+        return components_with_rfq, supplier_products
 
-        # Créer une demande de prix pour chaque fournisseur
-        purchase_obj = self.env['purchase.order']
-        purchase_orders = []  # Liste pour stocker les bons de commande créés
+    def _create_rfqs(self, supplier_ids=None):
+        """Crée les demandes de prix des fournisseurs donnés (tous par défaut) et les rattache au plan.
 
-        for supplier, products in supplier_products.items():
-            # Créer l'entête de la demande de prix
-            po_vals = {
-                'partner_id': supplier.id,
+        Les fournisseurs ayant déjà une demande de prix en brouillon rattachée au plan, par exemple
+        créée par un traitement en arrière-plan interrompu, sont ignorés : la génération peut être
+        relancée sans doublon.
+        """
+        self.ensure_one()
+        components_with_rfq, supplier_products = self._get_rfq_supplier_products()
+        if supplier_ids is None:
+            supplier_ids = list(supplier_products)
+        existing_supplier_ids = set(self.purchase_order_ids.filtered(lambda po: po.state == 'draft').mapped('partner_id').ids)
+        supplier_products = {supplier_id: supplier_products[supplier_id]
+                             for supplier_id in supplier_ids
+                             if supplier_id in supplier_products and supplier_id not in existing_supplier_ids}
+
+        # Données des produits lues en une seule fois
+        products = components_with_rfq.mapped('product_id')
+        product_data = {product['id']: product for product in products.read(['name', 'uom_po_id'], load=False)}
+        date_planned = fields.Date.today()
+
+        # Une demande de prix par fournisseur, lignes comprises, créées en un seul appel
+        po_vals_list = []
+        for supplier_id, supplier_lines in supplier_products.items():
+            po_vals_list.append({
+                'partner_id': supplier_id,
                 'state': 'draft',
                 'origin': f'Réappro {self.name}',
-            }
-            purchase_order = purchase_obj.create(po_vals)
-            purchase_orders.append(purchase_order)
-
-            # Ajouter les lignes de produits
-            for product in products:
-                self.env['purchase.order.line'].create({
-                    'order_id': purchase_order.id,
-                    'product_id': product['product_id'],
-                    'product_qty': product['quantity'],
-                    'price_unit': product['price_unit'],
-                    'name': self.env['product.product'].browse(product['product_id']).name,
-                    'date_planned': fields.Date.today(),
-                    'product_uom': self.env['product.product'].browse(product['product_id']).uom_po_id.id,
-                })
+                'order_line': [(0, 0, {
+                    'product_id': line['product_id'],
+                    'product_qty': line['quantity'],
+                    'price_unit': line['price_unit'],
+                    'name': product_data[line['product_id']]['name'],
+                    'date_planned': date_planned,
+                    'product_uom': product_data[line['product_id']]['uom_po_id'],
+                }) for line in supplier_lines],
+            })
+        purchase_orders = self.env['purchase.order'].create(po_vals_list)
+        self.write({'purchase_order_ids': [(4, po.id) for po in purchase_orders]})
+        return purchase_orders
+
+    def _finalize_rfq(self):
+        """Crée le suivi à partir des demandes de prix du plan et valide le plan"""
+        self.ensure_one()
+        components_with_rfq = self.component_ids.filtered('supplier_line_ids')
 
-        # Créer le suivi du plan avec les composants qui ont des demandes de prix
-        tracking = self.env['replen.plan.tracking'].create_from_replen_plan(self, components_with_rfq, purchase_orders)
+        # Créer le suivi du plan avec les composants qui ont des demandes de prix encore actives
+        purchase_orders = self.purchase_order_ids.filtered(lambda po: po.state != 'cancel')
+        self.env['replen.plan.tracking'].create_from_replen_plan(self, components_with_rfq, purchase_orders)
 
         # Passage à l'état validé et mise à jour de la date de validation
         self.write({
             'state': 'done',
-            'validation_date': fields.Datetime.now()
+            'validation_date': fields.Datetime.now(),
         })
 
-        # Message de notification avec redirection
-        message = _('{} demande(s) de prix ont été générée(s) avec succès.').format(rfq_count)
-        return {
-            'type': 'ir.actions.client',
-            'tag': 'display_notification',
-            'params': {
-                'title': _('Succès'),
-                'message': message,
-                'sticky': False,
-                'type': 'success',
-                'next': self._return_form_action('done'),
-            },
-        }
+    def _get_simulator(self):
+        """Charge une fois en mémoire les données du plan nécessaires aux simulations"""
+        self.ensure_one()
+        return ReplenPlanSimulator(self)
+
+    def simulate_scenarios(self, scenarios):
+        """Évalue des scénarios de simulation sans aucune écriture en base.
+
+        Voir ReplenPlanSimulator pour le format des scénarios. Retourne, pour chaque scénario,
+        le coût total et la liste des composants (product_id, besoins, coût, retard de livraison).
+        """
+        self.ensure_one()
+        return self._get_simulator().evaluate_all(scenarios)
+
+    def _check_no_pending_job(self):
+        """Empêche de relancer une étape tant qu'un traitement en arrière-plan du plan n'est pas terminé"""
+        for plan in self:
+            if plan.job_id and plan.job_id.state not in ('done', 'cancelled'):
+                raise UserError(_(
+                    "Un traitement en arrière-plan est en cours ou en échec pour le plan %s. "
+                    "Attendez sa fin, relancez-le ou annulez-le avant de poursuivre."
+                ) % plan.name)
+
+    def _enqueue_job(self, job_type):
+        """Confie l'étape à la tâche planifiée et revient sur le formulaire de l'état courant"""
+        self.ensure_one()
+        self.env['replen.plan.job']._enqueue(self, job_type)
+        return self._return_form_action(self.state)
+
+    def action_resume_job(self):
+        self.ensure_one()
+        self.job_id.action_resume()
+        return self._return_form_action(self.state)
+
+    def action_cancel_job(self):
+        self.ensure_one()
+        self.job_id.action_cancel()
+        return self._return_form_action(self.state)
 
     @api.model
     def get_formview_id(self, access_uid=None):
@@ -948,6 +1650,9 @@ class ReplenPlan(models.Model):
         """Surcharge de la méthode d'écriture pour gérer les messages de bienvenue"""
         old_states = {rec.id: rec.state for rec in self}
         result = super(ReplenPlan, self).write(vals)
+        if vals.get('state') == 'report':
+            # Entrée en phase de rapport : recalcul des agrégats fournisseurs du plan
+            self.env['replen.plan.component.supplier.display']._refresh_plans(self, force=True)
         if 'state' in vals:
             for rec in self:
                 old_state = old_states.get(rec.id)
@@ -1022,37 +1727,57 @@ class ReplenPlan(models.Model):
             else:
                 plan.period = False
 
-    @api.depends('component_supplier_ids', 'component_supplier_ids.expected_delivery_date', 'date_end')
+    @api.depends('component_supplier_ids', 'date_end')
     def _compute_has_late_deliveries(self):
+        late_plan_ids = set(self._get_late_delivery_plan_ids())
         for plan in self:
-            plan.has_late_deliveries = False
-            for supplier in plan.component_supplier_ids:
-                if supplier.is_late_delivery:
-                    plan.has_late_deliveries = True
-                    break
+            plan.has_late_deliveries = plan.id in late_plan_ids
+
+    def _get_late_delivery_plan_ids(self):
+        """Retourne, en une seule requête, les plans ayant au moins une livraison hors période"""
+        plan_ids = [plan_id for plan_id in self.ids if isinstance(plan_id, int)]
+        if not plan_ids:
+            return []
+        self.env['replen.plan.component'].flush(['plan_id', 'product_id', 'quantity_to_supply'])
+        self.env['replen.plan.supplier.line'].flush(['component_id', 'supplier_id', 'price', 'delivery_lead_time'])
+        self.flush(['date_end'])
+        self.env.cr.execute("""
+            SELECT plan.id
+            FROM replen_plan plan
+            WHERE plan.id IN %s
+              AND EXISTS (
+                  SELECT 1 FROM replen_plan_component_supplier_display display
+                  WHERE display.plan_id = plan.id
+                    AND display.is_late_delivery
+              )
+        """, (tuple(plan_ids),))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _search_has_late_deliveries(self, operator, value):
+        if operator not in ('=', '!='):
+            raise UserError(_("Opérateur non pris en charge."))
+        self.env.cr.execute("""
+            SELECT DISTINCT plan_id FROM replen_plan_component_supplier_display
+            WHERE is_late_delivery
+        """)
+        late_plan_ids = [row[0] for row in self.env.cr.fetchall()]
+        positive = (operator == '=') == bool(value)
+        return [('id', 'in' if positive else 'not in', late_plan_ids)]
 
     def unlink(self):
         """Surcharge de la méthode unlink pour gérer la suppression d'un plan validé"""
-        for plan in self:
-            if plan.state == 'done':
-                # Récupérer les demandes de prix liées au plan
-                purchase_orders = self.env['purchase.order'].search([
-                    ('origin', '=', f'Réappro {plan.name}')
-                ])
-                
-                # Annuler les demandes de prix
-                for po in purchase_orders:
-                    if po.state not in ['cancel', 'done']:
-                        po.button_cancel()
-                
-                # Récupérer le suivi associé
-                tracking = self.env['replen.plan.tracking'].search([
-                    ('replen_plan_id', '=', plan.id)
-                ], limit=1)
-                
-                if tracking:
-                    tracking.unlink()
-                
+        validated_plans = self.filtered(lambda p: p.state == 'done')
+        if validated_plans:
+            # Annuler en une fois les demandes de prix liées aux plans
+            purchase_orders = validated_plans.mapped('purchase_order_ids')
+            purchase_orders.filtered(lambda po: po.state not in ['cancel', 'done']).button_cancel()
+
+            # Supprimer les suivis associés
+            self.env['replen.plan.tracking'].search([
+                ('replen_plan_id', 'in', validated_plans.ids)
+            ]).unlink()
+
+            for plan in validated_plans:
                 # Notifier l'utilisateur via le système de messagerie
                 message = _(
                     "Le plan de réapprovisionnement %(name)s a été supprimé.<br/>"
@@ -1060,7 +1785,7 @@ class ReplenPlan(models.Model):
                     "- Le suivi associé a été supprimé"
                 ) % {
                     'name': plan.name,
-                    'po_count': len(purchase_orders)
+                    'po_count': len(plan.purchase_order_ids)
                 }
                 
                 # Créer une note dans le chatter
@@ -1070,11 +1795,94 @@ class ReplenPlan(models.Model):
                     subtype_xmlid='mail.mt_note'
                 )
         
-        return super(ReplenPlan, self).unlink()
+        plan_ids = self.ids
+        res = super(ReplenPlan, self).unlink()
+        if plan_ids:
+            self.env.cr.execute(
+                "DELETE FROM replen_plan_component_supplier_agg WHERE plan_id IN %s",
+                (tuple(plan_ids),)
+            )
+        return res
+
+    def action_view_purchase_orders(self):
+        """Ouvre les demandes de prix générées par le plan"""
+        self.ensure_one()
+        action = self.env['ir.actions.act_window']._for_xml_id('purchase.purchase_rfq')
+        action['domain'] = [('id', 'in', self.purchase_order_ids.ids)]
+        action['context'] = {'create': False}
+        if len(self.purchase_order_ids) == 1:
+            action['views'] = [(self.env.ref('purchase.purchase_order_form').id, 'form')]
+            action['res_id'] = self.purchase_order_ids.id
+        return action
+
+    def action_compute_forecast(self):
+        """Calcule les prévisions de tous les produits du plan à partir de l'historique mensuel des ventes.
+
+        Toutes les séries sont traitées en une fois par le moteur de prévision ; pour chaque
+        produit, la méthode de plus faible erreur en validation est retenue.
+        """
+        self.ensure_one()
+        self._check_no_pending_job()
+        if self.state != 'forecast':
+            raise UserError(_("Le calcul des prévisions n'est possible qu'en phase de prévision."))
+        if np is None:
+            raise UserError(_("Le calcul des prévisions nécessite la bibliothèque Python NumPy."))
+        if not self.line_ids:
+            return True
+
+        lines = self.line_ids.read(['product_id', 'date'], load=False)
+        product_ids = sorted({line['product_id'] for line in lines})
+        product_index = {product_id: index for index, product_id in enumerate(product_ids)}
+
+        # Historique : les mois complets précédant le mois en cours
+        history_end = fields.Date.today().replace(day=1)
+        history_months = max(self.forecast_history_months, 1)
+        history_start = history_end - relativedelta(months=history_months)
+        month_index = {history_start + relativedelta(months=index): index for index in range(history_months)}
+        monthly_sales = self.env['replen.plan.sales.history']._get_monthly_sales(
+            product_ids, history_start, history_end, self.env.companies.ids)
+        history = np.zeros((len(product_ids), history_months))
+        for (product_id, month), qty in monthly_sales.items():
+            if month in month_index:
+                history[product_index[product_id], month_index[month]] = qty
+
+        # Horizon : écart en mois entre la fin de l'historique et chaque mois du plan
+        def steps_ahead(month):
+            return max((month.year - history_end.year) * 12 + month.month - history_end.month, 0)
+        horizon = max(steps_ahead(line['date']) for line in lines) + 1
+        forecasts, methods = forecast_series(history, horizon)
+
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        line_ids, quantities, line_methods = [], [], []
+        for line in lines:
+            position = product_index[line['product_id']]
+            line_ids.append(line['id'])
+            quantities.append(float_round(float(forecasts[position, steps_ahead(line['date'])]), precision_digits=precision))
+            line_methods.append(methods[position])
+
+        # Une seule requête pour toutes les lignes ; les prévisions modifiées sont à régénérer
+        Line = self.env['replen.plan.line']
+        fnames = ['forecast_qty', 'forecast_method', 'is_dirty']
+        Line.flush(fnames)
+        self.env.cr.execute("""
+            UPDATE replen_plan_line line
+               SET forecast_qty = res.forecast_qty,
+                   forecast_method = res.forecast_method,
+                   is_dirty = TRUE,
+                   write_uid = %s,
+                   write_date = (now() at time zone 'UTC')
+              FROM unnest(%s::int[], %s::float8[], %s::varchar[]) AS res(id, forecast_qty, forecast_method)
+             WHERE line.id = res.id
+        """, (self.env.uid, line_ids, quantities, line_methods))
+        updated = Line.browse(line_ids)
+        updated.invalidate_cache(fnames + ['write_uid', 'write_date'], line_ids)
+        updated.modified(fnames)
+        return True
 
     def action_copy_historic(self):
         """Copie les valeurs historiques dans les prévisions"""
         self.ensure_one()
+        self._check_no_pending_job()
         if self.state != 'forecast':
             raise UserError(_("La copie de l'historique n'est possible qu'en phase de prévision."))
             
@@ -0,0 +1,134 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Méthodes de prévision, dans l'ordre de préférence en cas d'égalité d'erreur
+FORECAST_METHODS = [
+    ('moving_average', 'Moyenne mobile'),
+    ('holt_winters', 'Holt-Winters saisonnier'),
+    ('croston', 'Croston (demande intermittente)'),
+]
+
+SEASON_LENGTH = 12
+
+
+def moving_average(history, horizon, window=3):
+    """Moyenne des window derniers mois, reconduite sur tout l'horizon.
+
+    history est une matrice séries × mois ; retourne une matrice séries × horizon.
+    """
+    window = max(1, min(window, history.shape[1]))
+    level = history[:, -window:].mean(axis=1)
+    return np.repeat(level[:, None], horizon, axis=1)
+
+
+def holt_winters(history, horizon, alpha=0.3, beta=0.05, gamma=0.2, season_length=SEASON_LENGTH):
+    """Lissage exponentiel de Holt-Winters additif, calculé pour toutes les séries à la fois.
+
+    Nécessite au moins deux saisons d'historique ; retourne None sinon.
+    """
+    n_months = history.shape[1]
+    if n_months < 2 * season_length:
+        return None
+
+    # Initialisation sur les deux premières saisons
+    first_season = history[:, :season_length]
+    second_season = history[:, season_length:2 * season_length]
+    level = first_season.mean(axis=1)
+    trend = (second_season.mean(axis=1) - level) / season_length
+    seasonals = first_season - level[:, None]
+
+    for month in range(n_months):
+        value = history[:, month]
+        season_pos = month % season_length
+        previous_level = level
+        level = alpha * (value - seasonals[:, season_pos]) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        seasonals[:, season_pos] = gamma * (value - level) + (1 - gamma) * seasonals[:, season_pos]
+
+    steps = np.arange(1, horizon + 1)
+    season_index = (n_months + steps - 1) % season_length
+    forecast = level[:, None] + trend[:, None] * steps[None, :] + seasonals[:, season_index]
+    return np.maximum(forecast, 0.0)
+
+
+def croston(history, horizon, alpha=0.1):
+    """Méthode de Croston pour les demandes intermittentes, calculée pour toutes les séries à la fois.
+
+    La taille des demandes et l'intervalle entre deux demandes sont lissés séparément ;
+    la prévision est leur rapport, reconduite sur tout l'horizon.
+    """
+    n_series, n_months = history.shape
+    nonzero = history > 0
+    counts = nonzero.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        size = np.where(counts > 0, history.sum(axis=1) / np.maximum(counts, 1), 0.0)
+        interval = np.where(counts > 0, n_months / np.maximum(counts, 1), 1.0)
+    periods = np.zeros(n_series)
+
+    for month in range(n_months):
+        periods += 1
+        demand = nonzero[:, month]
+        size = np.where(demand, size + alpha * (history[:, month] - size), size)
+        interval = np.where(demand, interval + alpha * (periods - interval), interval)
+        periods = np.where(demand, 0, periods)
+
+    level = np.where(counts > 0, size / np.maximum(interval, 1e-9), 0.0)
+    return np.repeat(level[:, None], horizon, axis=1)
+
+
+def _run_method(method, history, horizon):
+    if method == 'moving_average':
+        return moving_average(history, horizon)
+    if method == 'holt_winters':
+        return holt_winters(history, horizon)
+    return croston(history, horizon)
+
+
+def forecast_series(history, horizon, holdout=6):
+    """Prévoit toutes les séries et retient, par série, la méthode de plus faible erreur en validation.
+
+    Les holdout derniers mois de l'historique servent à mesurer l'erreur absolue moyenne
+    de chaque méthode ; la méthode retenue est ensuite recalculée sur tout l'historique.
+    Retourne (prévisions séries × horizon, liste des méthodes retenues par série).
+    """
+    if np is None:
+        raise ImportError("numpy")
+    history = np.asarray(history, dtype=float)
+    n_series, n_months = history.shape
+    methods = [method for method, label in FORECAST_METHODS]
+    if not n_series or not horizon:
+        return np.zeros((n_series, horizon)), [methods[0]] * n_series
+
+    # Erreurs de validation de chaque méthode (infinies si la méthode n'est pas applicable)
+    holdout = min(holdout, n_months // 4)
+    errors = np.full((len(methods), n_series), np.inf)
+    if holdout:
+        train, test = history[:, :-holdout], history[:, -holdout:]
+        for index, method in enumerate(methods):
+            backtest = _run_method(method, train, holdout)
+            if backtest is not None:
+                errors[index] = np.abs(backtest - test).mean(axis=1)
+    else:
+        errors[0] = 0.0
+    best = errors.argmin(axis=0)
+
+    # Prévisions définitives, calculées sur tout l'historique pour chaque méthode retenue
+    forecasts = np.zeros((n_series, horizon))
+    for index, method in enumerate(methods):
+        selected = best == index
+        if not selected.any():
+            continue
+        result = _run_method(method, history[selected], horizon)
+        if result is None:
+            result = moving_average(history[selected], horizon)
+        forecasts[selected] = result
+
+    _logger.info(f"Prévision de {n_series} série(s) sur {horizon} mois : "
+                 + ", ".join(f"{method} {int((best == index).sum())}" for index, method in enumerate(methods)))
+    return np.maximum(forecasts, 0.0), [methods[index] for index in best]
@@ -0,0 +1,280 @@
+from odoo import models, fields, api, _
+from datetime import timedelta
+import json
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+class ReplenPlanJob(models.Model):
+    _name = 'replen.plan.job'
+    _description = 'Traitement en arrière-plan des plans de réapprovisionnement'
+    _order = 'create_date desc, id desc'
+
+    plan_id = fields.Many2one('replen.plan', string='Plan', required=True, ondelete='cascade', index=True)
+    job_type = fields.Selection([
+        ('forecast', 'Création des prévisions'),
+        ('generate', 'Génération du plan'),
+        ('regenerate', 'Régénération des prévisions modifiées'),
+        ('rfq', 'Génération des demandes de prix'),
+    ], string='Traitement', required=True, readonly=True)
+    state = fields.Selection([
+        ('queued', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'En échec'),
+        ('cancelled', 'Annulé'),
+    ], string='État', default='queued', required=True, readonly=True)
+    company_id = fields.Many2one('res.company', string='Société', required=True, readonly=True,
+                                 default=lambda self: self.env.company,
+                                 help="Société active du demandeur, sous laquelle le traitement est exécuté")
+    chunk_ids = fields.One2many('replen.plan.job.chunk', 'job_id', string='Lots', readonly=True)
+    chunk_size = fields.Integer(string='Taille des lots', default=200, readonly=True)
+    bom_data = fields.Text(string='Nomenclatures aplaties', readonly=True,
+                           help="Nomenclatures aplaties calculées à la préparation, partagées par tous les lots.")
+    date_started = fields.Datetime(string='Début', readonly=True)
+    date_finished = fields.Datetime(string='Fin', readonly=True)
+    error = fields.Text(string='Erreur', readonly=True)
+    progress = fields.Float(string='Avancement (%)', compute='_compute_progress')
+    eta = fields.Datetime(string='Fin estimée', compute='_compute_progress')
+    can_cancel = fields.Boolean(string='Annulable', compute='_compute_can_cancel')
+
+    # Délai sans avancement au-delà duquel un traitement en cours est considéré comme bloqué (secondes)
+    _stalled_timeout = 3600
+
+    @api.depends('chunk_ids.state', 'state', 'date_started')
+    def _compute_progress(self):
+        now = fields.Datetime.now()
+        for job in self:
+            total = len(job.chunk_ids)
+            done = len(job.chunk_ids.filtered(lambda c: c.state == 'done'))
+            if job.state == 'done':
+                job.progress = 100.0
+            else:
+                job.progress = (done / total * 100.0) if total else 0.0
+            job.eta = False
+            if job.state == 'running' and job.date_started and total and done:
+                # Extrapolation à partir du temps passé sur les lots déjà terminés
+                elapsed = (now - job.date_started).total_seconds()
+                job.eta = now + timedelta(seconds=elapsed * (total - done) / done)
+
+    def _is_stalled(self):
+        """Indique si le traitement en cours n'a plus avancé depuis _stalled_timeout secondes
+        (tâche planifiée désactivée, processus interrompu en cours de lot...)"""
+        self.ensure_one()
+        if self.state != 'running':
+            return False
+        activity = [date for date in self.chunk_ids.mapped('write_date') + [self.date_started, self.write_date] if date]
+        return not activity or fields.Datetime.now() - max(activity) > timedelta(seconds=self._stalled_timeout)
+
+    @api.depends('state', 'date_started', 'chunk_ids.state')
+    def _compute_can_cancel(self):
+        for job in self:
+            job.can_cancel = job.state in ('queued', 'failed') or job._is_stalled()
+
+    def name_get(self):
+        job_types = dict(self._fields['job_type'].selection)
+        return [(job.id, f"{job.plan_id.name} - {job_types.get(job.job_type)}") for job in self]
+
+    @api.model
+    def _enqueue(self, plan, job_type):
+        """Crée le traitement d'un plan et demande son exécution par la tâche planifiée"""
+        job = self.create({
+            'plan_id': plan.id,
+            'job_type': job_type,
+        })
+        plan.job_id = job
+        self._trigger_cron()
+        return job
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref('replen_plan.ir_cron_replen_plan_job', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    def action_resume(self):
+        """Relance les lots en échec sans refaire les lots déjà terminés"""
+        for job in self.filtered(lambda j: j.state == 'failed'):
+            job.chunk_ids.filtered(lambda c: c.state == 'failed').write({'state': 'pending', 'error': False})
+            job.write({'state': 'queued', 'error': False, 'date_finished': False})
+        self._trigger_cron()
+        return True
+
+    def action_cancel(self):
+        """Abandonne un traitement en échec, en attente ou bloqué : les lots déjà terminés sont conservés,
+        le plan peut être repris à la main.
+
+        Relancer l'étape est sans risque de doublon : les demandes de prix déjà créées par les
+        lots terminés restent rattachées au plan et ne sont pas recréées (voir _create_rfqs).
+        """
+        self.filtered('can_cancel').write({
+            'state': 'cancelled',
+            'date_finished': fields.Datetime.now(),
+        })
+        return True
+
+    @api.model
+    def _cron_process_jobs(self, time_limit=300):
+        """Traite les plans en attente, lot par lot, avec une validation par lot.
+
+        Chaque traitement est exécuté avec les droits et la société de l'utilisateur qui l'a demandé,
+        et non avec ceux de l'utilisateur de la tâche planifiée. Au-delà de time_limit secondes, la
+        tâche planifiée est relancée pour poursuivre.
+        """
+        deadline = time.time() + time_limit
+        for job in self.search([('state', 'in', ['queued', 'running'])], order='id'):
+            job = job.with_user(job.create_uid).with_company(job.company_id)
+            if not job._process(deadline):
+                self._trigger_cron()
+                break
+        return True
+
+    def _process(self, deadline):
+        """Exécute les lots restants du traitement. Retourne False si le temps imparti est écoulé."""
+        self.ensure_one()
+        if self.state == 'queued':
+            self.write({'state': 'running', 'date_started': self.date_started or fields.Datetime.now()})
+            self.env.cr.commit()
+
+        if not self.chunk_ids:
+            try:
+                with self.env.cr.savepoint():
+                    self._prepare_chunks()
+            except Exception as e:
+                _logger.exception(f"Préparation du traitement {self.display_name} en échec")
+                self.env.clear()
+                self.write({'state': 'failed', 'error': str(e), 'date_finished': fields.Datetime.now()})
+                self.env.cr.commit()
+                return True
+            self.env.cr.commit()
+
+        for chunk in self.chunk_ids.filtered(lambda c: c.state == 'pending').sorted('sequence'):
+            if time.time() > deadline:
+                return False
+            # Le traitement a pu être annulé depuis l'interface entre deux lots
+            self.invalidate_cache(['state'], self.ids)
+            if self.state == 'cancelled':
+                return True
+            chunk._run()
+            self.env.cr.commit()
+
+        if self.chunk_ids.filtered(lambda c: c.state == 'failed'):
+            self.write({'state': 'failed', 'error': _("Certains lots sont en échec."), 'date_finished': fields.Datetime.now()})
+        else:
+            try:
+                with self.env.cr.savepoint():
+                    self._finalize()
+                    self.write({'state': 'done', 'date_finished': fields.Datetime.now()})
+            except Exception as e:
+                _logger.exception(f"Finalisation du traitement {self.display_name} en échec")
+                self.env.clear()
+                self.write({'state': 'failed', 'error': str(e), 'date_finished': fields.Datetime.now()})
+        self.env.cr.commit()
+        return True
+
+    def _split(self, ids):
+        size = max(self.chunk_size, 1)
+        return [ids[index:index + size] for index in range(0, len(ids), size)]
+
+    def _prepare_chunks(self):
+        """Prépare le plan et découpe le traitement en lots (produits, composants ou fournisseurs)"""
+        self.ensure_one()
+        plan = self.plan_id
+        if self.job_type == 'forecast':
+            plan.line_ids.unlink()
+            plan.component_ids.unlink()
+            batches = self._split(plan.product_ids.ids)
+        elif self.job_type == 'generate':
+            plan.component_ids.unlink()
+            flat_boms = plan._get_flattened_boms(plan.line_ids.mapped('product_id'))
+            self.bom_data = json.dumps(flat_boms)
+            component_ids = sorted({component_id for leaves in flat_boms.values() for component_id in leaves})
+            batches = self._split(component_ids)
+        elif self.job_type == 'regenerate':
+            # Mise à jour sur place des composants existants : un seul lot
+            batches = [[]]
+        else:
+            components_with_rfq, supplier_products = plan._get_rfq_supplier_products()
+            batches = self._split(sorted(supplier_products))
+
+        self.env['replen.plan.job.chunk'].create([{
+            'job_id': self.id,
+            'sequence': sequence,
+            'payload': json.dumps(batch),
+        } for sequence, batch in enumerate(batches)])
+        _logger.info(f"Traitement {self.display_name} : {len(batches)} lot(s)")
+
+    def _get_flat_boms(self, component_ids=None):
+        """Relit les nomenclatures aplaties, restreintes si besoin à certains composants"""
+        self.ensure_one()
+        flat_boms = {
+            int(product_id): {int(component_id): qty for component_id, qty in leaves.items()}
+            for product_id, leaves in json.loads(self.bom_data or '{}').items()
+        }
+        if component_ids is None:
+            return flat_boms
+        component_ids = set(component_ids)
+        return {
+            product_id: {component_id: qty for component_id, qty in leaves.items() if component_id in component_ids}
+            for product_id, leaves in flat_boms.items()
+        }
+
+    def _run_chunk(self, ids):
+        """Traite un lot d'identifiants selon le type de traitement"""
+        self.ensure_one()
+        plan = self.plan_id
+        if self.job_type == 'forecast':
+            plan._create_forecast_lines(self.env['product.product'].browse(ids), plan._get_months_in_period())
+        elif self.job_type == 'generate':
+            component_needs = plan._compute_component_needs(self._get_flat_boms(ids))
+            plan._create_component_lines(component_needs)
+        elif self.job_type == 'regenerate':
+            plan._regenerate_dirty_components()
+        else:
+            plan._create_rfqs(supplier_ids=ids)
+
+    def _finalize(self):
+        """Passe le plan à l'état suivant une fois tous les lots terminés"""
+        self.ensure_one()
+        plan = self.plan_id
+        if self.job_type == 'forecast':
+            plan.write({'state': 'forecast'})
+        elif self.job_type == 'generate':
+            plan.line_ids.filtered('is_dirty').write({'is_dirty': False})
+            plan.write({'state': 'plan'})
+        elif self.job_type == 'regenerate':
+            plan.write({'state': 'plan'})
+        else:
+            plan._finalize_rfq()
+
+class ReplenPlanJobChunk(models.Model):
+    _name = 'replen.plan.job.chunk'
+    _description = 'Lot de traitement en arrière-plan'
+    _order = 'job_id, sequence'
+
+    job_id = fields.Many2one('replen.plan.job', string='Traitement', required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(string='Séquence', readonly=True)
+    payload = fields.Text(string='Identifiants', readonly=True)
+    state = fields.Selection([
+        ('pending', 'En attente'),
+        ('done', 'Terminé'),
+        ('failed', 'En échec'),
+    ], string='État', default='pending', required=True, readonly=True)
+    duration = fields.Float(string='Durée (s)', readonly=True)
+    error = fields.Text(string='Erreur', readonly=True)
+
+    def _run(self):
+        """Exécute le lot dans un point de sauvegarde : un échec n'annule que ce lot"""
+        self.ensure_one()
+        started = time.time()
+        try:
+            with self.env.cr.savepoint():
+                self.job_id._run_chunk(json.loads(self.payload or '[]'))
+        except Exception as e:
+            _logger.exception(f"Lot {self.sequence} du traitement {self.job_id.display_name} en échec")
+            self.env.clear()
+            self.write({'state': 'failed', 'error': str(e), 'duration': time.time() - started})
+            return False
+        self.write({'state': 'done', 'duration': time.time() - started})
+        return True
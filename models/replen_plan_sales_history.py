@@ -0,0 +1,166 @@
+from odoo import models, fields, api
+from collections import defaultdict
+from dateutil.relativedelta import relativedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+class ReplenPlanSalesHistory(models.Model):
+    _name = 'replen.plan.sales.history'
+    _description = 'Historique mensuel des ventes'
+    _order = 'date desc, product_id'
+
+    product_id = fields.Many2one('product.product', string='Produit', required=True, readonly=True, index=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Société', required=True, readonly=True, index=True, ondelete='cascade')
+    date = fields.Date('Mois', required=True, readonly=True, index=True)
+    qty_delivered = fields.Float('Quantité livrée', digits='Product Unit of Measure', readonly=True)
+
+    _sql_constraints = [
+        ('product_company_date_uniq', 'unique(product_id, company_id, date)',
+         "Il ne peut exister qu'une ligne d'historique par produit, société et mois."),
+    ]
+
+    def init(self):
+        # Alimentation initiale du cube à l'installation du module
+        self.env.cr.execute("SELECT 1 FROM replen_plan_sales_history LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _rebuild(self):
+        """Reconstruit entièrement le cube à partir des livraisons clients validées"""
+        self.env['stock.move'].flush(['product_id', 'company_id', 'state', 'date', 'location_dest_id', 'product_uom_qty'])
+        self.env.cr.execute("DELETE FROM replen_plan_sales_history")
+        self.env.cr.execute("""
+            INSERT INTO replen_plan_sales_history
+                (product_id, company_id, date, qty_delivered, create_uid, create_date, write_uid, write_date)
+            SELECT sm.product_id,
+                   sm.company_id,
+                   date_trunc('month', sm.date)::date,
+                   SUM(sm.product_uom_qty),
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM stock_move sm
+            JOIN stock_location dest ON dest.id = sm.location_dest_id
+            WHERE sm.state = 'done'
+              AND dest.usage = 'customer'
+            GROUP BY sm.product_id, sm.company_id, date_trunc('month', sm.date)
+        """, {'uid': self.env.uid})
+        _logger.info(f"Historique mensuel des ventes reconstruit ({self.env.cr.rowcount} lignes)")
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def _add_moves(self, moves):
+        """Ajoute de façon incrémentale les livraisons clients validées au cube"""
+        totals = defaultdict(float)
+        for move in moves:
+            if move.state != 'done' or move.location_dest_id.usage != 'customer':
+                continue
+            key = (move.product_id.id, move.company_id.id, move.date.date().replace(day=1))
+            totals[key] += move.product_uom_qty
+        if not totals:
+            return
+
+        product_ids, company_ids, dates, quantities = [], [], [], []
+        for (product_id, company_id, month), qty in totals.items():
+            product_ids.append(product_id)
+            company_ids.append(company_id)
+            dates.append(month)
+            quantities.append(qty)
+
+        self.flush(['qty_delivered'])
+        self.env.cr.execute("""
+            INSERT INTO replen_plan_sales_history
+                (product_id, company_id, date, qty_delivered, create_uid, create_date, write_uid, write_date)
+            SELECT data.product_id, data.company_id, data.date, data.qty,
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM unnest(%(product_ids)s::int[], %(company_ids)s::int[], %(dates)s::date[], %(quantities)s::float8[])
+                AS data(product_id, company_id, date, qty)
+            ON CONFLICT (product_id, company_id, date) DO UPDATE
+            SET qty_delivered = replen_plan_sales_history.qty_delivered + EXCLUDED.qty_delivered,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """, {
+            'uid': self.env.uid,
+            'product_ids': product_ids,
+            'company_ids': company_ids,
+            'dates': dates,
+            'quantities': quantities,
+        })
+        self.invalidate_cache(['qty_delivered'])
+
+    @api.model
+    def _get_monthly_sales(self, product_ids, start_date, end_date, company_ids):
+        """Retourne {(product_id, mois): quantité} pour les mois compris entre start_date (inclus) et end_date (exclu).
+
+        Seules les ventes des sociétés company_ids sont prises en compte.
+        """
+        if not product_ids or not company_ids:
+            return {}
+        self.flush(['product_id', 'date', 'qty_delivered'])
+        self.env.cr.execute("""
+            SELECT product_id, date, SUM(qty_delivered)
+            FROM replen_plan_sales_history
+            WHERE product_id IN %s
+              AND company_id IN %s
+              AND date >= %s
+              AND date < %s
+            GROUP BY product_id, date
+        """, (tuple(product_ids), tuple(company_ids), start_date, end_date))
+        return {(product_id, month): qty or 0.0 for product_id, month, qty in self.env.cr.fetchall()}
+
+    @api.model
+    def _get_windowed_sales(self, product_ids, months, offsets, company_ids, weights=None):
+        """Calcule en une seule requête une moyenne pondérée des ventes pour chaque couple (produit, mois).
+
+        Pour un mois donné, la fenêtre est formée des mois situés offsets mois avant lui, chacun
+        affecté du poids correspondant (1 par défaut) ; un mois sans vente compte pour zéro.
+        Seules les ventes des sociétés company_ids sont prises en compte.
+        Retourne {(product_id, mois): quantité}.
+        """
+        if not product_ids or not months or not offsets or not company_ids:
+            return {}
+        if weights is None:
+            weights = [1.0] * len(offsets)
+        start_date = min(months) - relativedelta(months=max(offsets))
+        end_date = max(months) - relativedelta(months=min(offsets)) + relativedelta(months=1)
+
+        self.flush(['product_id', 'date', 'qty_delivered'])
+        self.env.cr.execute("""
+            WITH sales AS (
+                SELECT product_id, date, SUM(qty_delivered) AS qty
+                FROM replen_plan_sales_history
+                WHERE product_id = ANY(%(product_ids)s)
+                  AND company_id = ANY(%(company_ids)s)
+                  AND date >= %(start_date)s
+                  AND date < %(end_date)s
+                GROUP BY product_id, date
+            )
+            SELECT target_product.product_id,
+                   target_month.month,
+                   SUM(win.weight * COALESCE(sales.qty, 0)) / SUM(win.weight)
+            FROM unnest(%(product_ids)s::int[]) AS target_product(product_id)
+            CROSS JOIN unnest(%(months)s::date[]) AS target_month(month)
+            CROSS JOIN unnest(%(offsets)s::int[], %(weights)s::float8[]) AS win(offset_months, weight)
+            LEFT JOIN sales
+              ON sales.product_id = target_product.product_id
+             AND sales.date = (target_month.month - make_interval(months => win.offset_months))::date
+            GROUP BY target_product.product_id, target_month.month
+        """, {
+            'product_ids': list(product_ids),
+            'company_ids': list(company_ids),
+            'months': list(months),
+            'offsets': list(offsets),
+            'weights': [float(weight) for weight in weights],
+            'start_date': start_date,
+            'end_date': end_date,
+        })
+        return {(product_id, month): qty or 0.0 for product_id, month, qty in self.env.cr.fetchall()}
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+
+    def _action_done(self, cancel_backorder=False):
+        moves = super(StockMove, self)._action_done(cancel_backorder=cancel_backorder)
+        self.env['replen.plan.sales.history'].sudo()._add_moves(moves)
+        return moves
@@ -0,0 +1,175 @@
+from odoo import fields
+from collections import defaultdict
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class ReplenPlanSimulator(object):
+    """Simulation en mémoire de scénarios sur un plan de réapprovisionnement.
+
+    Les prévisions, les nomenclatures aplaties, les stocks et les fournisseurs du plan sont
+    chargés une seule fois dans des structures compactes. Chaque scénario est ensuite évalué
+    sans aucune écriture en base.
+
+    Un scénario est un dictionnaire dont toutes les clés sont facultatives :
+        - name : libellé du scénario
+        - demand_factor : coefficient appliqué à toutes les prévisions (1.1 pour +10 %)
+        - product_factors : {product_id: coefficient} par produit fini
+        - forecast_overrides : {(product_id, mois): quantité} remplaçant des prévisions (appel Python uniquement)
+        - suppliers : {component_id: supplier_id} fournisseur retenu par composant
+        - delay_days : retard de réception appliqué à tous les composants (jours)
+        - component_delays : {component_id: jours} retard de réception par composant
+    """
+
+    def __init__(self, plan):
+        plan.ensure_one()
+        self.plan_name = plan.name
+        self.date_end = plan.date_end
+        self.today = fields.Date.context_today(plan)
+        Component = plan.env['replen.plan.component']
+        self.precision = plan.env['decimal.precision'].precision_get('Product Unit of Measure')
+        self._net_requirements = Component._net_requirements
+
+        # Prévisions : matrice produits × mois
+        forecasts = plan.line_ids.read(['product_id', 'date', 'forecast_qty'], load=False)
+        self.product_ids = sorted({row['product_id'] for row in forecasts})
+        self.months = sorted({row['date'] for row in forecasts})
+        self.product_index = {product_id: index for index, product_id in enumerate(self.product_ids)}
+        self.month_index = {month: index for index, month in enumerate(self.months)}
+        self.forecasts = [[0.0] * len(self.months) for product_id in self.product_ids]
+        for row in forecasts:
+            self.forecasts[self.product_index[row['product_id']]][self.month_index[row['date']]] += row['forecast_qty']
+
+        # Nomenclatures aplaties : quantités par unité, produits × composants
+        flat_boms = plan._get_flattened_boms(plan.env['product.product'].browse(self.product_ids))
+        self.component_ids = sorted({component_id for leaves in flat_boms.values() for component_id in leaves})
+        self.component_index = {component_id: index for index, component_id in enumerate(self.component_ids)}
+        self.bom_entries = [
+            (self.product_index[product_id], self.component_index[component_id], unit_qty)
+            for product_id, leaves in flat_boms.items() if product_id in self.product_index
+            for component_id, unit_qty in leaves.items()
+        ]
+
+        # Stocks actuels et de sécurité
+        self.stock = plan._get_component_stock_data(self.component_ids)
+
+        # Fournisseurs : lignes du plan si elles existent, sinon fiches fournisseurs des produits
+        self.suppliers = defaultdict(dict)
+        component_products = {row['id']: row['product_id'] for row in plan.component_ids.read(['product_id'], load=False)}
+        for line in plan.env['replen.plan.supplier.line'].search_read(
+                [('component_id', 'in', list(component_products))],
+                ['component_id', 'supplier_id', 'price', 'delivery_lead_time'], order='id'):
+            self.suppliers[component_products[line['component_id'][0]]].setdefault(
+                line['supplier_id'][0], (line['price'], line['delivery_lead_time'] or 0))
+        missing = [component_id for component_id in self.component_ids if component_id not in self.suppliers]
+        if missing:
+            sellers = Component._get_sellers_by_product(plan.env['product.product'].browse(missing))
+            for component_id, component_sellers in sellers.items():
+                for seller in component_sellers:
+                    self.suppliers[component_id].setdefault(seller.name.id, (seller.price, seller.delay or 0))
+
+        # Version vectorisée des données si NumPy est disponible
+        self.forecast_matrix = None
+        if np is not None and self.product_ids and self.component_ids:
+            self.forecast_matrix = np.array(self.forecasts, dtype=float)
+            self.bom_matrix = np.zeros((len(self.product_ids), len(self.component_ids)))
+            for product_pos, component_pos, unit_qty in self.bom_entries:
+                self.bom_matrix[product_pos, component_pos] += unit_qty
+
+        _logger.info(f"Simulation du plan {self.plan_name} : {len(self.product_ids)} produit(s), "
+                     f"{len(self.component_ids)} composant(s), {len(self.months)} mois")
+
+    @staticmethod
+    def _int_keys(values):
+        # Les clés des dictionnaires reçus par RPC sont des chaînes
+        return {int(key): value for key, value in (values or {}).items()}
+
+    def _get_component_needs(self, scenario):
+        """Retourne la liste, par composant, des besoins mensuels du scénario"""
+        product_factors = self._int_keys(scenario.get('product_factors'))
+        factors = [scenario.get('demand_factor', 1.0) * product_factors.get(product_id, 1.0)
+                   for product_id in self.product_ids]
+        overrides = scenario.get('forecast_overrides', {})
+
+        if self.forecast_matrix is not None:
+            forecast_matrix = self.forecast_matrix
+            if overrides:
+                forecast_matrix = forecast_matrix.copy()
+                for (product_id, month), qty in overrides.items():
+                    if product_id in self.product_index and month in self.month_index:
+                        forecast_matrix[self.product_index[product_id], self.month_index[month]] = qty
+            needs = self.bom_matrix.T @ (forecast_matrix * np.array(factors)[:, None])
+            return needs.tolist()
+
+        forecasts = self.forecasts
+        if overrides:
+            forecasts = [list(row) for row in forecasts]
+            for (product_id, month), qty in overrides.items():
+                if product_id in self.product_index and month in self.month_index:
+                    forecasts[self.product_index[product_id]][self.month_index[month]] = qty
+        needs = [[0.0] * len(self.months) for component_id in self.component_ids]
+        for product_pos, component_pos, unit_qty in self.bom_entries:
+            factor = factors[product_pos] * unit_qty
+            row = needs[component_pos]
+            for month_pos, qty in enumerate(forecasts[product_pos]):
+                row[month_pos] += qty * factor
+        return needs
+
+    def evaluate(self, scenario):
+        """Évalue un scénario et retourne besoins, coûts et retards par composant.
+
+        Le résultat ne contient que des clés de type chaîne, pour pouvoir être renvoyé par XML-RPC.
+        """
+        needs = self._get_component_needs(scenario)
+        chosen_suppliers = self._int_keys(scenario.get('suppliers'))
+        delay_days = scenario.get('delay_days', 0)
+        component_delays = self._int_keys(scenario.get('component_delays'))
+
+        components = []
+        total_cost = 0.0
+        late_component_ids = []
+        for component_pos, component_id in enumerate(self.component_ids):
+            current_stock, safety_stock = self.stock.get(component_id, (0.0, 0.0))
+            netting = self._net_requirements(current_stock, safety_stock, needs[component_pos],
+                                             precision_digits=self.precision)
+            quantity_to_supply = sum(result['suggested_quantity'] for result in netting)
+
+            # Fournisseur retenu : celui du scénario s'il est connu, sinon le premier disponible
+            component_suppliers = self.suppliers.get(component_id, {})
+            supplier_id = chosen_suppliers.get(component_id)
+            if supplier_id not in component_suppliers:
+                supplier_id = next(iter(component_suppliers), False)
+            price, lead_time = component_suppliers.get(supplier_id, (0.0, 0))
+            lead_time += delay_days + component_delays.get(component_id, 0)
+            expected_date = self.today + timedelta(days=lead_time)
+            is_late = bool(quantity_to_supply > 0 and self.date_end and expected_date > self.date_end)
+
+            cost = quantity_to_supply * price
+            total_cost += cost
+            if is_late:
+                late_component_ids.append(component_id)
+            components.append({
+                'product_id': component_id,
+                'needs': {fields.Date.to_string(month): qty for month, qty in zip(self.months, needs[component_pos])},
+                'quantity_to_supply': quantity_to_supply,
+                'supplier_id': supplier_id,
+                'cost': cost,
+                'expected_date': fields.Date.to_string(expected_date),
+                'is_late': is_late,
+            })
+
+        return {
+            'name': scenario.get('name', ''),
+            'components': components,
+            'total_cost': total_cost,
+            'late_component_ids': late_component_ids,
+        }
+
+    def evaluate_all(self, scenarios):
+        return [self.evaluate(scenario) for scenario in scenarios]
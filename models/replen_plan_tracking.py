@@ -1,4 +1,6 @@
 from odoo import models, fields, api
+from odoo.tools import float_compare, float_round
+from collections import defaultdict
 from datetime import datetime, timedelta
 import logging
 
@@ -90,53 +92,51 @@ class ReplenPlanTracking(models.Model):
             'name': replen_plan.name,
             'state': 'in_progress',  # État initial : En cours
         })
-        
-        # Créer un dictionnaire pour associer les produits aux lignes de commande par fournisseur
-        product_vendor_po_lines = {}
+
+        # Indexer les lignes de commande par produit puis par fournisseur
+        po_lines_by_product = defaultdict(lambda: defaultdict(list))
         for po in purchase_orders:
             for line in po.order_line:
-                key = (line.product_id.id, line.partner_id.id)
-                if key not in product_vendor_po_lines:
-                    product_vendor_po_lines[key] = []
-                product_vendor_po_lines[key].append(line)
+                po_lines_by_product[line.product_id.id][line.partner_id.id].append(line)
 
-        # Créer les lignes de suivi pour chaque combinaison composant-fournisseur
+        # Délais de livraison par couple (produit, fournisseur) depuis les lignes fournisseur des composants
+        lead_times = {}
         for component in components_with_rfq:
-            # Trouver toutes les combinaisons produit-fournisseur pour ce composant
-            for key, po_lines in product_vendor_po_lines.items():
-                product_id, vendor_id = key
-                if product_id == component.product_id.id:
-                    # Récupérer le délai de livraison depuis les lignes fournisseur du composant
-                    supplier_line = component.supplier_line_ids.filtered(
-                        lambda l: l.supplier_id.id == vendor_id
-                    )
-                    
-                    lead_time = supplier_line.delivery_lead_time if supplier_line else 0
-                    first_po_line = po_lines[0]
-                    
-                    # Calculer la quantité totale commandée pour ce fournisseur
-                    quantity_ordered = sum(line.product_qty for line in po_lines)
-                    
-                    # Debug logs
-                    _logger.info(f"Calcul du prix total pour le produit {component.product_id.name}:")
-                    _logger.info(f"Prix unitaire: {first_po_line.price_unit}")
-                    _logger.info(f"Quantité commandée: {quantity_ordered}")
-                    
-                    # Calculer le prix total
-                    total_price = float(first_po_line.price_unit or 0.0) * float(quantity_ordered or 0.0)
-                    _logger.info(f"Prix total calculé: {total_price}")
-                    
-                    self.env['replen.plan.tracking.line'].create({
-                        'tracking_id': tracking.id,
-                        'product_id': component.product_id.id,
-                        'vendor_id': vendor_id,
-                        'lead_time': lead_time,
-                        'total_price': total_price,
-                        'quantity_to_supply': quantity_ordered,
-                        'quantity_received': 0.0,
-                        'purchase_order_line_ids': [(6, 0, [line.id for line in po_lines])],
-                    })
-        
+            for supplier_line in component.supplier_line_ids:
+                lead_times.setdefault(
+                    (component.product_id.id, supplier_line.supplier_id.id),
+                    supplier_line.delivery_lead_time
+                )
+
+        # Une ligne de suivi par combinaison composant-fournisseur
+        tracking_lines = []
+        seen_products = set()
+        for component in components_with_rfq:
+            product_id = component.product_id.id
+            if product_id in seen_products:
+                continue
+            seen_products.add(product_id)
+
+            for vendor_id, po_lines in po_lines_by_product.get(product_id, {}).items():
+                # Quantité totale commandée pour ce fournisseur et prix total associé
+                quantity_ordered = sum(line.product_qty for line in po_lines)
+                total_price = float(po_lines[0].price_unit or 0.0) * float(quantity_ordered or 0.0)
+
+                tracking_lines.append({
+                    'tracking_id': tracking.id,
+                    'product_id': product_id,
+                    'vendor_id': vendor_id,
+                    'lead_time': lead_times.get((product_id, vendor_id), 0),
+                    'total_price': total_price,
+                    'quantity_to_supply': quantity_ordered,
+                    'quantity_received': 0.0,
+                    'purchase_order_line_ids': [(6, 0, [line.id for line in po_lines])],
+                })
+
+        if tracking_lines:
+            self.env['replen.plan.tracking.line'].create(tracking_lines)
+        _logger.info(f"Suivi {tracking.name} créé avec {len(tracking_lines)} ligne(s)")
+
         return tracking
 
     @api.depends('component_line_ids', 'component_line_ids.state', 'replen_plan_id.date_end')
@@ -156,6 +156,15 @@ class ReplenPlanTracking(models.Model):
         else:
             self.state = 'in_progress'
 
+    @api.model
+    def _cron_reconcile_received_quantities(self):
+        """Rapprochement des quantités reçues de tous les suivis encore ouverts"""
+        trackings = self.search([('state', '!=', 'done')])
+        tracking_lines = trackings.mapped('component_line_ids').filtered(lambda l: l.state != 'rejected')
+        tracking_lines.update_received_quantity()
+        _logger.info(f"Rapprochement des réceptions : {len(tracking_lines)} ligne(s) sur {len(trackings)} suivi(s)")
+        return True
+
     def action_view_delivery_graph(self):
         self.ensure_one()
         return {
@@ -191,61 +200,99 @@ class ReplenPlanTrackingLine(models.Model):
     
     quantity_received = fields.Float(string='Quantité reçue', digits='Product Unit of Measure', tracking=True)
     quantity_pending = fields.Float(string='Quantité en attente', compute='_compute_quantity_pending', store=True, digits='Product Unit of Measure')
-    purchase_order_line_ids = fields.Many2many('purchase.order.line', string='Lignes de commande')
+    purchase_order_line_ids = fields.Many2many(
+        'purchase.order.line',
+        'purchase_order_line_replen_plan_tracking_line_rel',
+        'replen_plan_tracking_line_id',
+        'purchase_order_line_id',
+        string='Lignes de commande'
+    )
     state = fields.Selection([
         ('waiting', 'En attente'),
         ('partial', 'En cours'),
         ('done', 'Terminé'),
         ('late', 'En retard'),
         ('rejected', 'Rejeté')
-    ], string='État', compute='_compute_state', store=True, tracking=True)
+    ], string='État', default='waiting', readonly=True)
 
-    @api.depends('quantity_to_supply', 'quantity_received', 'expected_date', 'purchase_order_line_ids', 'purchase_order_line_ids.order_id.state', 'tracking_id.replen_plan_id.date_end')
-    def _compute_state(self):
+    def _get_target_states(self):
+        """Calcule l'état de chaque ligne à partir des états des commandes et des quantités reçues.
+
+        Aucune écriture n'est effectuée : les états des commandes et les dates de fin des plans
+        sont lus une seule fois pour tout le lot. Retourne {line_id: état}.
+        """
         today = fields.Date.today()
+        po_lines = self.mapped('purchase_order_line_ids')
+        po_line_orders = {row['id']: row['order_id'] for row in po_lines.read(['order_id'], load=False)}
+        order_states = {row['id']: row['state'] for row in po_lines.mapped('order_id').read(['state'])}
+        plan_end_dates = {tracking.id: tracking.replen_plan_id.date_end for tracking in self.mapped('tracking_id')}
+
+        states = {}
         for line in self:
-            old_state = line.state
-            
-            # Si pas de lignes de commande, mettre l'état à rejeté et remettre les valeurs à 0
-            if not line.purchase_order_line_ids:
-                line.write({
-                    'state': 'rejected',
-                    'quantity_to_supply': 0.0,
-                    'quantity_received': 0.0,
-                    'quantity_pending': 0.0,
-                    'total_price': 0.0,
-                    'expected_date': False,
-                    'lead_time': 0,
-                })
-            elif all(pol.order_id.state in ['purchase', 'done'] for pol in line.purchase_order_line_ids):
+            po_line_ids = line.purchase_order_line_ids.ids
+            if not po_line_ids:
+                # Plus aucune ligne de commande : la ligne est rejetée
+                states[line.id] = 'rejected'
+            elif all(order_states.get(po_line_orders.get(po_line_id)) in ['purchase', 'done'] for po_line_id in po_line_ids):
                 if line.quantity_received > 0:
-                    if line.quantity_received < line.quantity_to_supply:
-                        line.state = 'partial'
-                    else:
-                        line.state = 'done'
+                    states[line.id] = 'partial' if line.quantity_received < line.quantity_to_supply else 'done'
                 else:
                     # Vérifier si la date de réception prévue est après la date de fin du plan
-                    plan_end_date = line.tracking_id.replen_plan_id.date_end
+                    plan_end_date = plan_end_dates.get(line.tracking_id.id)
                     if line.expected_date and plan_end_date and line.expected_date > plan_end_date:
-                        line.state = 'late'
+                        states[line.id] = 'late'
                     elif line.expected_date and line.expected_date < today:
-                        line.state = 'late'
+                        states[line.id] = 'late'
                     else:
-                        line.state = 'waiting'
+                        states[line.id] = 'waiting'
             else:
-                line.state = 'waiting'
-
-            # Enregistrer le changement d'état dans le chatter
-            if old_state != line.state:
-                line.tracking_id.message_post(
-                    body=f"Le composant <b>{line.product_id.name}</b> est passé de l'état <b>{dict(line._fields['state'].selection).get(old_state, 'Nouveau')}</b> à <b>{dict(line._fields['state'].selection).get(line.state)}</b>",
-                    message_type='notification',
-                    subtype_xmlid='mail.mt_note'
+                states[line.id] = 'waiting'
+        return states
+
+    def _update_states(self):
+        """Met à jour les états des lignes par écritures groupées.
+
+        Un seul message récapitulatif est publié par suivi, et check_completion n'est
+        appelé qu'une fois par suivi concerné.
+        """
+        if not self:
+            return
+        target_states = self._get_target_states()
+        state_labels = dict(self._fields['state'].selection)
+
+        lines_by_state = defaultdict(list)
+        changes_by_tracking = defaultdict(list)
+        for line in self:
+            new_state = target_states[line.id]
+            if line.state != new_state:
+                lines_by_state[new_state].append(line.id)
+                changes_by_tracking[line.tracking_id].append(
+                    f"- <b>{line.product_id.name}</b> : {state_labels.get(line.state, 'Nouveau')} → {state_labels.get(new_state)}"
                 )
-            
-            # Appeler check_completion sur le tracking parent
-            if line.tracking_id:
-                line.tracking_id.check_completion()
+
+        for state, line_ids in lines_by_state.items():
+            vals = {'state': state}
+            if state == 'rejected':
+                # Sans ligne de commande, les valeurs de la ligne sont remises à zéro
+                vals.update({
+                    'quantity_to_supply': 0.0,
+                    'quantity_received': 0.0,
+                    'total_price': 0.0,
+                    'expected_date': False,
+                    'lead_time': 0,
+                })
+            self.browse(line_ids).write(vals)
+
+        # Enregistrer les changements d'état dans le chatter, un message par suivi
+        for tracking, changes in changes_by_tracking.items():
+            tracking.message_post(
+                body=f"Changement d'état des composants :<br/>{'<br/>'.join(changes)}",
+                message_type='notification',
+                subtype_xmlid='mail.mt_note'
+            )
+
+        for tracking in self.mapped('tracking_id'):
+            tracking.check_completion()
 
     @api.depends('lead_time', 'tracking_id.validation_date')
     def _compute_expected_date(self):
@@ -265,58 +312,7 @@ class ReplenPlanTrackingLine(models.Model):
 
     @api.model
     def create_from_replen_plan(self, replen_plan, components_with_rfq, purchase_orders):
-        tracking = self.create({
-            'replen_plan_id': replen_plan.id,
-            'name': replen_plan.name,
-        })
-        
-        # Créer un dictionnaire pour associer les produits aux lignes de commande par fournisseur
-        product_vendor_po_lines = {}
-        for po in purchase_orders:
-            for line in po.order_line:
-                key = (line.product_id.id, line.partner_id.id)
-                if key not in product_vendor_po_lines:
-                    product_vendor_po_lines[key] = []
-                product_vendor_po_lines[key].append(line)
-
-        # Créer les lignes de suivi pour chaque combinaison composant-fournisseur
-        for component in components_with_rfq:
-            # Trouver toutes les combinaisons produit-fournisseur pour ce composant
-            for key, po_lines in product_vendor_po_lines.items():
-                product_id, vendor_id = key
-                if product_id == component.product_id.id:
-                    # Récupérer le délai de livraison depuis les lignes fournisseur du composant
-                    supplier_line = component.supplier_line_ids.filtered(
-                        lambda l: l.supplier_id.id == vendor_id
-                    )
-                    
-                    lead_time = supplier_line.delivery_lead_time if supplier_line else 0
-                    first_po_line = po_lines[0]
-                    
-                    # Calculer la quantité totale commandée pour ce fournisseur
-                    quantity_ordered = sum(line.product_qty for line in po_lines)
-                    
-                    # Debug logs
-                    _logger.info(f"Calcul du prix total pour le produit {component.product_id.name}:")
-                    _logger.info(f"Prix unitaire: {first_po_line.price_unit}")
-                    _logger.info(f"Quantité commandée: {quantity_ordered}")
-                    
-                    # Calculer le prix total
-                    total_price = float(first_po_line.price_unit or 0.0) * float(quantity_ordered or 0.0)
-                    _logger.info(f"Prix total calculé: {total_price}")
-                    
-                    self.env['replen.plan.tracking.line'].create({
-                        'tracking_id': tracking.id,
-                        'product_id': component.product_id.id,
-                        'vendor_id': vendor_id,
-                        'lead_time': lead_time,
-                        'total_price': total_price,
-                        'quantity_to_supply': quantity_ordered,
-                        'quantity_received': 0.0,
-                        'purchase_order_line_ids': [(6, 0, [line.id for line in po_lines])],
-                    })
-        
-        return tracking
+        return self.env['replen.plan.tracking'].create_from_replen_plan(replen_plan, components_with_rfq, purchase_orders)
 
     def update_from_purchase_order(self, purchase_order_line):
         self.ensure_one()
@@ -346,39 +342,60 @@ class ReplenPlanTrackingLine(models.Model):
         })
 
     def update_received_quantity(self):
+        """Met à jour les quantités reçues de tout le lot à partir des quantités reçues des lignes de commande.
+
+        qty_received est déjà exprimée dans l'unité de la ligne de commande et tient compte des retours fournisseur.
+        """
+        po_lines = self.mapped('purchase_order_line_ids')
+        received_by_po_line = {row['id']: row['qty_received'] for row in po_lines.read(['qty_received'])}
+
+        # Regrouper les lignes par quantité reçue pour écrire en une fois chaque valeur distincte
+        lines_by_qty = defaultdict(list)
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
         for line in self:
-            received_qty = sum(move.product_uom_qty
-                             for pol in line.purchase_order_line_ids
-                             for move in pol.move_ids
-                             if move.state == 'done')
-            line.quantity_received = received_qty
-            line.tracking_id.check_completion()
-
-    def update_from_purchase_order_line(self, purchase_order_line):
-        """Met à jour les valeurs de la ligne de suivi en fonction des modifications de la ligne de demande de prix"""
-        self.ensure_one()
-        
-        # Calculer la nouvelle quantité totale à partir de toutes les lignes de commande
-        quantity_to_supply = sum(line.product_qty for line in self.purchase_order_line_ids)
-        
-        # Calculer le nouveau prix total
-        total_price = sum(line.price_unit * line.product_qty for line in self.purchase_order_line_ids)
-        
-        # Si la date planifiée a été modifiée dans la demande de prix, on met à jour notre date
-        if purchase_order_line.date_planned:
-            self.expected_date = fields.Date.to_date(purchase_order_line.date_planned)
-        
-        # Mettre à jour les valeurs
-        self.write({
-            'quantity_to_supply': quantity_to_supply,
-            'total_price': total_price,
-        })
+            received_qty = sum(received_by_po_line.get(po_line_id, 0.0) for po_line_id in line.purchase_order_line_ids.ids)
+            if float_compare(received_qty, line.quantity_received, precision_digits=precision) != 0:
+                lines_by_qty[float_round(received_qty, precision_digits=precision)].append(line.id)
+        for received_qty, line_ids in lines_by_qty.items():
+            self.browse(line_ids).write({'quantity_received': received_qty})
+
+        self._update_states()
+
+    def _refresh_from_purchase_order_lines(self, date_line_ids=()):
+        """Recalcule les lignes de suivi à partir de leurs lignes de commande actuelles.
+
+        Le traitement est idempotent : il peut être rejoué sans effet de bord, quel que soit
+        le nombre d'événements regroupés. La date prévue n'est reprise des commandes que pour
+        les lignes de date_line_ids. Les lignes aux valeurs identiques sont écrites en une fois.
+        """
+        precision = self.env['decimal.precision'].precision_get('Product Unit of Measure')
+        currency = self.env.company.currency_id
+        lines_by_vals = defaultdict(list)
+        empty_lines = self.browse()
+        for line in self:
+            po_lines = line.purchase_order_line_ids
+            if not po_lines:
+                empty_lines |= line
+                continue
+            vals = {
+                'quantity_to_supply': float_round(sum(po_line.product_qty for po_line in po_lines), precision_digits=precision),
+                'total_price': currency.round(sum(po_line.price_unit * po_line.product_qty for po_line in po_lines)),
+            }
+            planned_dates = [po_line.date_planned for po_line in po_lines if po_line.date_planned]
+            if line.id in date_line_ids and planned_dates:
+                vals['expected_date'] = fields.Date.to_date(max(planned_dates))
+            lines_by_vals[tuple(sorted(vals.items()))].append(line.id)
+        for vals, line_ids in lines_by_vals.items():
+            self.browse(line_ids).write(dict(vals))
+        # Plus aucune ligne de commande : réinitialiser avant le passage à l'état rejeté
+        empty_lines.reset_tracking_line()
+        self.update_received_quantity()
 
     def reset_tracking_line(self):
-        """Réinitialise les valeurs de la ligne de suivi après suppression de la ligne de commande"""
-        self.ensure_one()
-        if self.state != 'rejected':
-            self.write({
+        """Réinitialise les valeurs des lignes de suivi après suppression de leurs lignes de commande"""
+        lines = self.filtered(lambda l: l.state != 'rejected')
+        if lines:
+            lines.write({
                 'vendor_id': False,
                 'lead_time': 0,
                 'total_price': 0,
@@ -392,8 +409,49 @@ class ReplenPlanTrackingLine(models.Model):
         for line in self:
             line.quantity_pending = line.quantity_to_supply - line.quantity_received
 
+    def _sync_purchase_line_links(self):
+        """Reporte sur les lignes de commande le lien vers leur ligne de suivi.
+
+        Ce lien inverse (replen_tracking_line_id) permet aux surcharges des achats et des
+        réceptions d'ignorer sans recherche les documents étrangers au réapprovisionnement.
+        """
+        if not self:
+            return
+        self.flush(['purchase_order_line_ids'])
+        self.env['purchase.order.line'].flush(['replen_tracking_line_id'])
+        # Retirer les liens des lignes de commande détachées
+        self.env.cr.execute("""
+            UPDATE purchase_order_line pol
+            SET replen_tracking_line_id = NULL
+            WHERE pol.replen_tracking_line_id IN %(ids)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM purchase_order_line_replen_plan_tracking_line_rel rel
+                  WHERE rel.purchase_order_line_id = pol.id
+                    AND rel.replen_plan_tracking_line_id = pol.replen_tracking_line_id
+              )
+        """, {'ids': tuple(self.ids)})
+        # Poser les liens des lignes de commande rattachées
+        self.env.cr.execute("""
+            UPDATE purchase_order_line pol
+            SET replen_tracking_line_id = rel.replen_plan_tracking_line_id
+            FROM purchase_order_line_replen_plan_tracking_line_rel rel
+            WHERE rel.purchase_order_line_id = pol.id
+              AND rel.replen_plan_tracking_line_id IN %(ids)s
+        """, {'ids': tuple(self.ids)})
+        self.env['purchase.order.line'].invalidate_cache(['replen_tracking_line_id'])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(ReplenPlanTrackingLine, self).create(vals_list)
+        records._sync_purchase_line_links()
+        return records
+
     def write(self, vals):
-        # Pour chaque ligne, enregistrer les anciennes valeurs avant modification
+        """Écriture groupée avec suivi des modifications.
+
+        Les anciennes valeurs sont lues en une fois, l'écriture est unique pour tout le lot
+        et un seul message récapitulatif est publié par suivi.
+        """
         tracked_fields = {
             'quantity_to_supply': ('Quantité à réapprovisionner', 'Product Unit of Measure'),
             'quantity_received': ('Quantité reçue', 'Product Unit of Measure'),
@@ -402,72 +460,93 @@ class ReplenPlanTrackingLine(models.Model):
             'lead_time': ('Délai', 'jours'),
             'expected_date': ('Date de réception prévue', 'date'),
         }
-
+        changed_fields = [field for field in tracked_fields if field in vals]
+        track_po_lines = 'purchase_order_line_ids' in vals
+        if not self or not (changed_fields or track_po_lines):
+            return super(ReplenPlanTrackingLine, self).write(vals)
+
+        # Instantané des anciennes valeurs en une seule lecture
+        read_fields = changed_fields + (['purchase_order_line_ids'] if track_po_lines else [])
+        old_values = {row['id']: row for row in self.read(read_fields, load=False)}
+
+        res = super(ReplenPlanTrackingLine, self).write(vals)
+
+        new_po_line_ids = {}
+        po_lines_by_id = {}
+        if track_po_lines:
+            new_po_line_ids = {row['id']: set(row['purchase_order_line_ids']) for row in self.read(['purchase_order_line_ids'], load=False)}
+            moved_ids = set()
+            for line_id, po_line_ids in new_po_line_ids.items():
+                moved_ids |= po_line_ids ^ set(old_values[line_id]['purchase_order_line_ids'])
+            po_lines_by_id = {po_line.id: po_line for po_line in self.env['purchase.order.line'].browse(moved_ids).exists()}
+
+        currency = self.env.company.currency_id
+        changes_by_tracking = defaultdict(list)
         for line in self:
+            old = old_values[line.id]
+            uom_name = line.product_id.uom_id.name
             changes = []
-            for field, (label, unit_type) in tracked_fields.items():
-                if field in vals and vals[field] != getattr(line, field):
-                    old_value = getattr(line, field)
-                    new_value = vals[field]
-                    
-                    # Formatage spécial selon le type de champ
+            for field in changed_fields:
+                label, unit_type = tracked_fields[field]
+                old_value = old[field]
+                new_value = vals[field]
+
+                # Formatage spécial selon le type de champ
+                if unit_type == 'date':
+                    new_value = fields.Date.to_date(new_value) if new_value else False
+                    if (old_value or False) == new_value:
+                        continue
+                    old_str = old_value.strftime('%d/%m/%Y') if old_value else 'Non défini'
+                    new_str = new_value.strftime('%d/%m/%Y') if new_value else 'Non défini'
+                else:
+                    if old_value == new_value:
+                        continue
                     if unit_type == 'Product Unit of Measure':
-                        old_str = f"{old_value} {line.product_id.uom_id.name}"
-                        new_str = f"{new_value} {line.product_id.uom_id.name}"
+                        old_str = f"{old_value} {uom_name}"
+                        new_str = f"{new_value} {uom_name}"
                     elif unit_type == 'currency':
-                        currency = self.env.company.currency_id
                         old_str = f"{currency.symbol} {old_value}"
                         new_str = f"{currency.symbol} {new_value}"
-                    elif unit_type == 'date':
-                        old_str = old_value.strftime('%d/%m/%Y') if old_value else 'Non défini'
-                        new_str = fields.Date.from_string(new_value).strftime('%d/%m/%Y') if new_value else 'Non défini'
                     elif unit_type == 'jours':
                         old_str = f"{old_value} jours"
                         new_str = f"{new_value} jours"
                     else:
                         old_str = str(old_value)
                         new_str = str(new_value)
-                    
-                    changes.append(f"- {label} : {old_str} → {new_str}")
+                changes.append(f"- {label} : {old_str} → {new_str}")
 
             # Suivre les modifications des demandes de prix
-            if 'purchase_order_line_ids' in vals:
-                old_po_lines = line.purchase_order_line_ids
-                res = super(ReplenPlanTrackingLine, self).write(vals)
-                new_po_lines = line.purchase_order_line_ids
-                
-                # Identifier les nouvelles lignes ajoutées
-                added_lines = new_po_lines - old_po_lines
-                for po_line in added_lines:
-                    line.tracking_id.message_post(
-                        body=f"""Nouvelle demande de prix pour le composant <b>{line.product_id.name}</b>:<br/>
-                              - Commande: {po_line.order_id.name}<br/>
-                              - Quantité: {po_line.product_qty} {po_line.product_uom.name}<br/>
-                              - Prix unitaire: {po_line.price_unit} {po_line.order_id.currency_id.symbol}""",
-                        message_type='notification',
-                        subtype_xmlid='mail.mt_note'
-                    )
-                
-                # Identifier les lignes supprimées
-                removed_lines = old_po_lines - new_po_lines
-                for po_line in removed_lines:
-                    line.tracking_id.message_post(
-                        body=f"Suppression de la demande de prix {po_line.order_id.name} pour le composant <b>{line.product_id.name}</b>",
-                        message_type='notification',
-                        subtype_xmlid='mail.mt_note'
-                    )
-            else:
-                res = super(ReplenPlanTrackingLine, self).write(vals)
+            if track_po_lines:
+                old_ids = set(old['purchase_order_line_ids'])
+                new_ids = new_po_line_ids[line.id]
+                for po_line_id in sorted(new_ids - old_ids):
+                    po_line = po_lines_by_id.get(po_line_id)
+                    if po_line:
+                        changes.append(
+                            f"- Nouvelle demande de prix {po_line.order_id.name} : "
+                            f"{po_line.product_qty} {po_line.product_uom.name} à {po_line.price_unit} {po_line.order_id.currency_id.symbol}"
+                        )
+                for po_line_id in sorted(old_ids - new_ids):
+                    po_line = po_lines_by_id.get(po_line_id)
+                    order_name = po_line.order_id.name if po_line else f"#{po_line_id}"
+                    changes.append(f"- Suppression de la demande de prix {order_name}")
 
-            # Si des changements ont été détectés, les enregistrer dans le chatter
             if changes:
-                line.tracking_id.message_post(
-                    body=f"""Modification des valeurs pour le composant <b>{line.product_id.name}</b>:<br/>
-                          {'<br/>'.join(changes)}""",
-                    message_type='notification',
-                    subtype_xmlid='mail.mt_note'
+                changes_by_tracking[line.tracking_id].append(
+                    f"<b>{line.product_id.name}</b> :<br/>{'<br/>'.join(changes)}"
                 )
 
+        # Un message récapitulatif par suivi
+        for tracking, sections in changes_by_tracking.items():
+            tracking.message_post(
+                body=f"Modification des composants :<br/>{'<br/>'.join(sections)}",
+                message_type='notification',
+                subtype_xmlid='mail.mt_note'
+            )
+
+        if track_po_lines:
+            self._sync_purchase_line_links()
+
         return res
 
     @api.depends('tracking_id.name', 'product_id.name')
@@ -478,22 +557,98 @@ class ReplenPlanTrackingLine(models.Model):
             else:
                 record.display_name = "Nouveau"
 
+class ReplenPlanTrackingQueue(models.Model):
+    _name = 'replen.plan.tracking.queue'
+    _description = 'File de rafraîchissement des lignes de suivi'
+    _order = 'id'
+    _log_access = False
+
+    tracking_line_id = fields.Many2one('replen.plan.tracking.line', string='Ligne de suivi', required=True, index=True, ondelete='cascade')
+    event = fields.Selection([
+        ('purchase', 'Modification de commande'),
+        ('cancel', 'Annulation de commande'),
+        ('receipt', 'Réception'),
+        ('unlink', 'Suppression de ligne de commande'),
+    ], string='Événement', required=True)
+
+    @api.model
+    def _enqueue(self, tracking_lines, event):
+        """Met en file les lignes de suivi à rafraîchir, sans autre traitement dans la transaction appelante"""
+        if not tracking_lines:
+            return
+        self.env.cr.execute("""
+            INSERT INTO replen_plan_tracking_queue (tracking_line_id, event)
+            SELECT unnest(%s::int[]), %s
+        """, (tracking_lines.ids, event))
+        # Demander un passage anticipé du traitement de la file, une seule fois par transaction :
+        # le déclenchement est différé à la validation de la transaction appelante
+        precommit = self.env.cr.precommit
+        if not precommit.data.get('replen_plan_tracking_queue_trigger'):
+            precommit.data['replen_plan_tracking_queue_trigger'] = True
+            precommit.add(self._trigger_cron)
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref('replen_plan.ir_cron_replen_plan_tracking_queue', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _process_queue(self, batch_size=500, auto_commit=True):
+        """Traite la file par lots de lignes de suivi distinctes.
+
+        Tous les événements en attente d'une même ligne sont regroupés en un seul
+        rafraîchissement, qui recalcule la ligne à partir de ses lignes de commande.
+        """
+        TrackingLine = self.env['replen.plan.tracking.line']
+        while True:
+            self.env.cr.execute("""
+                SELECT DISTINCT tracking_line_id
+                FROM replen_plan_tracking_queue
+                ORDER BY tracking_line_id
+                LIMIT %s
+            """, (batch_size,))
+            line_ids = [row[0] for row in self.env.cr.fetchall()]
+            if not line_ids:
+                break
+            self.env.cr.execute("""
+                DELETE FROM replen_plan_tracking_queue
+                WHERE tracking_line_id IN %s
+                RETURNING tracking_line_id, event
+            """, (tuple(line_ids),))
+            date_line_ids = {line_id for line_id, event in self.env.cr.fetchall() if event == 'purchase'}
+
+            tracking_lines = TrackingLine.browse(line_ids).exists()
+            tracking_lines._refresh_from_purchase_order_lines(date_line_ids=date_line_ids)
+            _logger.info(f"File de suivi : {len(tracking_lines)} ligne(s) rafraîchie(s)")
+            if auto_commit:
+                self.env.cr.commit()
+            if len(line_ids) < batch_size:
+                break
+        return True
+
 class PurchaseOrder(models.Model):
     _inherit = 'purchase.order'
 
+    replen_plan_ids = fields.Many2many(
+        'replen.plan',
+        'replen_plan_purchase_order_rel',
+        'purchase_order_id',
+        'plan_id',
+        string='Plans de réapprovisionnement',
+        copy=False,
+        readonly=True
+    )
+
     def button_confirm(self):
         res = super(PurchaseOrder, self).button_confirm()
-        for order in self:
-            tracking_lines = self.env['replen.plan.tracking.line'].search([
-                ('purchase_order_line_ids', 'in', order.order_line.ids)
-            ])
-            for tracking_line in tracking_lines:
-                # Forcer le recalcul de l'état
-                tracking_line._compute_state()
-                # Mettre à jour les valeurs
-                tracking_line.update_from_purchase_order_line(order.order_line.filtered(
-                    lambda l: l.id in tracking_line.purchase_order_line_ids.ids
-                )[0])
+        # Seules les lignes de commande issues d'un plan de réapprovisionnement sont concernées
+        self.env['replen.plan.tracking.queue'].sudo()._enqueue(self.mapped('order_line.replen_tracking_line_id'), 'purchase')
+        return res
+
+    def button_cancel(self):
+        res = super(PurchaseOrder, self).button_cancel()
+        self.env['replen.plan.tracking.queue'].sudo()._enqueue(self.mapped('order_line.replen_tracking_line_id'), 'cancel')
         return res
 
 class StockPicking(models.Model):
@@ -501,42 +656,30 @@ class StockPicking(models.Model):
 
     def _action_done(self):
         res = super(StockPicking, self)._action_done()
-        for picking in self:
-            if picking.picking_type_code == 'incoming':
-                tracking_lines = self.env['replen.plan.tracking.line'].search([
-                    ('purchase_order_line_ids.move_ids.picking_id', '=', picking.id)
-                ])
-                tracking_lines.update_received_quantity()
+        incoming_pickings = self.filtered(lambda p: p.picking_type_code == 'incoming')
+        tracking_lines = incoming_pickings.mapped('move_lines.purchase_line_id.replen_tracking_line_id')
+        self.env['replen.plan.tracking.queue'].sudo()._enqueue(tracking_lines, 'receipt')
         return res
 
 class PurchaseOrderLine(models.Model):
     _inherit = 'purchase.order.line'
 
+    replen_tracking_line_id = fields.Many2one(
+        'replen.plan.tracking.line',
+        string='Ligne de suivi du réapprovisionnement',
+        index=True,
+        copy=False,
+        readonly=True,
+        ondelete='set null'
+    )
+
     def unlink(self):
         """Surcharge de la méthode unlink pour mettre à jour les lignes de suivi lors de la suppression"""
         # Récupérer les lignes de suivi avant la suppression
-        tracking_lines = self.env['replen.plan.tracking.line'].search([
-            ('purchase_order_line_ids', 'in', self.ids)
-        ])
-        
-        # Supprimer la ligne de commande
+        tracking_lines = self.mapped('replen_tracking_line_id')
         res = super(PurchaseOrderLine, self).unlink()
-        
-        # Mettre à jour les lignes de suivi
-        for tracking_line in tracking_lines:
-            remaining_lines = tracking_line.purchase_order_line_ids.filtered(lambda l: l.id not in self.ids)
-            if not remaining_lines and tracking_line.state != 'rejected':
-                # Si plus aucune ligne de commande et pas rejeté, réinitialiser la ligne de suivi
-                tracking_line.reset_tracking_line()
-            elif remaining_lines and tracking_line.state != 'rejected':
-                # Recalculer avec les lignes restantes si pas rejeté
-                quantity_to_supply = sum(line.product_qty for line in remaining_lines)
-                total_price = sum(line.price_unit * line.product_qty for line in remaining_lines)
-                tracking_line.write({
-                    'quantity_to_supply': quantity_to_supply,
-                    'total_price': total_price,
-                })
-        
+        # Les lignes sans commande restante seront réinitialisées puis rejetées par la file
+        self.env['replen.plan.tracking.queue'].sudo()._enqueue(tracking_lines.exists(), 'unlink')
         return res
 
     def write(self, vals):
@@ -545,11 +688,6 @@ class PurchaseOrderLine(models.Model):
         
         # Si le prix, la quantité ou la date planifiée ont été modifiés
         if any(field in vals for field in ['price_unit', 'product_qty', 'date_planned']):
-            tracking_lines = self.env['replen.plan.tracking.line'].search([
-                ('purchase_order_line_ids', 'in', self.ids)
-            ])
-            for tracking_line in tracking_lines:
-                if tracking_line.state != 'rejected':
-                    tracking_line.update_from_purchase_order_line(self)
+            self.env['replen.plan.tracking.queue'].sudo()._enqueue(self.mapped('replen_tracking_line_id'), 'purchase')
         
-        return res 
\ No newline at end of file
+        return res
@@ -0,0 +1,5 @@
+from . import test_historic_sales
+from . import test_generation_engines
+from . import test_replen_plan_job
+from . import test_simulation
+from . import test_release_schedule
@@ -0,0 +1,115 @@
+from odoo.tests.common import TransactionCase, tagged
+from odoo import fields
+from datetime import date
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def create_bom(env, product, lines):
+    """Crée la nomenclature d'un produit à partir d'une liste de couples (composant, quantité)"""
+    return env['mrp.bom'].create({
+        'product_tmpl_id': product.product_tmpl_id.id,
+        'product_id': product.id,
+        'product_qty': 1.0,
+        'bom_line_ids': [(0, 0, {'product_id': component.id, 'product_qty': qty}) for component, qty in lines],
+    })
+
+
+@tagged('post_install', '-at_install')
+@unittest.skipIf(np is None, "Le moteur matriciel nécessite NumPy")
+class TestGenerationEngines(TransactionCase):
+    """Les moteurs de génération Python et matriciel calculent les mêmes besoins"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestGenerationEngines, cls).setUpClass()
+        Product = cls.env['product.product']
+        cls.finished_1, cls.finished_2, cls.sub_assembly, cls.sub_sub_assembly = Product.create([{
+            'name': name,
+            'type': 'product',
+        } for name in ('Produit fini 1', 'Produit fini 2', 'Sous-ensemble', 'Sous-sous-ensemble')])
+        cls.component_1, cls.component_2, cls.component_3 = Product.create([{
+            'name': f'Composant {index}',
+            'type': 'product',
+        } for index in range(1, 4)])
+
+        # Deux produits finis partageant un sous-ensemble, lui-même composé d'un sous-sous-ensemble
+        create_bom(cls.env, cls.finished_1, [(cls.sub_assembly, 2.0), (cls.component_1, 1.0)])
+        create_bom(cls.env, cls.finished_2, [(cls.sub_assembly, 1.0), (cls.component_2, 3.0),
+                                         (cls.sub_sub_assembly, 0.5)])
+        create_bom(cls.env, cls.sub_assembly, [(cls.component_1, 0.5), (cls.sub_sub_assembly, 4.0)])
+        create_bom(cls.env, cls.sub_sub_assembly, [(cls.component_3, 1.5), (cls.component_2, 2.0)])
+
+        cls.plan = cls.env['replen.plan'].create({
+            'period_type': 'annual',
+            'sub_period_annual': str(fields.Date.today().year + 1),
+            'product_ids': [(6, 0, (cls.finished_1 | cls.finished_2).ids)],
+        })
+        months = cls.plan._get_months_in_period()
+        # Quantités variées, dont des prévisions nulles qui doivent tout de même produire des besoins
+        cls.env['replen.plan.line'].create([{
+            'plan_id': cls.plan.id,
+            'product_id': product.id,
+            'date': month,
+            'forecast_qty': 0.0 if (index + month.month) % 3 == 0 else 7.5 * (index + 1) + month.month,
+        } for index, product in enumerate(cls.finished_1 | cls.finished_2) for month in months])
+        # Un mois sans aucune prévision ne doit apparaître dans aucun des deux résultats
+        cls.plan.line_ids.filtered(lambda l: l.date == months[-1]).unlink()
+
+    def _get_needs(self, engine):
+        self.plan.generation_engine = engine
+        flat_boms = self.plan._get_flattened_boms(self.plan.line_ids.mapped('product_id'))
+        component_needs = self.plan._compute_component_needs(flat_boms)
+        return {
+            (component_id, month_date): month_data['qty']
+            for component_id, data in component_needs.items()
+            for month_date, month_data in data['monthly_data'].items()
+        }
+
+    def test_engines_parity(self):
+        python_needs = self._get_needs('python')
+        matrix_needs = self._get_needs('matrix')
+
+        self.assertTrue(python_needs)
+        self.assertEqual(set(python_needs), set(matrix_needs))
+        for key, qty in python_needs.items():
+            self.assertAlmostEqual(qty, matrix_needs[key], places=6, msg=f"Besoin différent pour {key}")
+
+        # Seuls les composants finaux sont présents, sous-ensembles exclus
+        component_ids = {component_id for component_id, month_date in python_needs}
+        self.assertEqual(component_ids, {self.component_1.id, self.component_2.id, self.component_3.id})
+
+    def test_engines_parity_on_zero_forecasts(self):
+        self.plan.line_ids.write({'forecast_qty': 0.0})
+        python_needs = self._get_needs('python')
+        matrix_needs = self._get_needs('matrix')
+
+        self.assertEqual(set(python_needs), set(matrix_needs))
+        self.assertTrue(all(qty == 0.0 for qty in matrix_needs.values()))
+        self.assertNotIn(date(self.plan.date_end.year, 12, 1),
+                         {month_date for component_id, month_date in matrix_needs})
+
+
+@tagged('post_install', '-at_install')
+class TestFlattenedBoms(TransactionCase):
+    """L'aplatissement des nomenclatures ne dépend pas de la profondeur à laquelle un produit est rencontré"""
+
+    def test_deep_shared_sub_assembly(self):
+        Product = self.env['product.product']
+        chain = Product.create([{'name': f'Niveau {level}', 'type': 'product'} for level in range(13)])
+        component = Product.create({'name': 'Composant final', 'type': 'product'})
+        shortcut = Product.create({'name': 'Produit court', 'type': 'product'})
+
+        # Chaîne de 12 niveaux de sous-ensembles, dont l'avant-dernier est aussi utilisé directement
+        for parent, child in zip(chain, chain[1:] | component):
+            create_bom(self.env, parent, [(child, 2.0)])
+        create_bom(self.env, shortcut, [(chain[11], 1.0)])
+
+        plan = self.env['replen.plan'].new({})
+        flat_boms = plan._get_flattened_boms(chain[0] | shortcut)
+        self.assertEqual(flat_boms[chain[0].id], {component.id: 2.0 ** 13})
+        self.assertEqual(flat_boms[shortcut.id], {component.id: 4.0})
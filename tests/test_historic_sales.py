@@ -0,0 +1,99 @@
+from odoo.models import INSERT_BATCH_SIZE
+from odoo.tests.common import TransactionCase, tagged
+from odoo import fields
+from datetime import date
+import math
+
+
+@tagged('post_install', '-at_install')
+class TestHistoricSales(TransactionCase):
+    """Le nombre de requêtes de l'historique des ventes ne dépend pas du nombre de produits"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestHistoricSales, cls).setUpClass()
+        cls.next_year = fields.Date.today().year + 1
+        cls.products = cls.env['product.product'].create([{
+            'name': f'Produit historique {index}',
+            'type': 'product',
+        } for index in range(20)])
+        # Ventes de janvier de l'année en cours : historique de janvier de l'année prochaine
+        cls.env['replen.plan.sales.history'].create([{
+            'product_id': product.id,
+            'company_id': cls.env.company.id,
+            'date': date(cls.next_year - 1, 1, 1),
+            'qty_delivered': 5.0 + index,
+        } for index, product in enumerate(cls.products)])
+
+    def _create_plan(self, products):
+        return self.env['replen.plan'].create({
+            'period_type': 'annual',
+            'sub_period_annual': str(self.next_year),
+            'product_ids': [(6, 0, products.ids)],
+        })
+
+    def _count_queries(self, function):
+        self.env['base'].flush()
+        start = self.cr.sql_log_count
+        function()
+        self.env['base'].flush()
+        return self.cr.sql_log_count - start
+
+    def test_historic_values(self):
+        plan = self._create_plan(self.products[:2])
+        plan.action_to_forecast()
+        january = plan.line_ids.filtered(lambda l: l.date == date(self.next_year, 1, 1))
+        self.assertEqual(len(january), 2)
+        for index, product in enumerate(self.products[:2]):
+            line = january.filtered(lambda l: l.product_id == product)
+            self.assertAlmostEqual(line.historic_qty, 5.0 + index)
+        february = plan.line_ids.filtered(lambda l: l.date == date(self.next_year, 2, 1))
+        self.assertTrue(all(line.historic_qty == 0.0 for line in february))
+
+    def test_historic_sales_query_count(self):
+        small_plan = self._create_plan(self.products[:2])
+        large_plan = self._create_plan(self.products)
+        months = small_plan._get_months_in_period()
+
+        # Premier appel pour remplir les caches (séquences, précisions, droits d'accès)
+        small_plan._get_historic_sales_bulk(self.products[:2].ids, months)
+
+        small_count = self._count_queries(
+            lambda: small_plan._get_historic_sales_bulk(self.products[:2].ids, months))
+        large_count = self._count_queries(
+            lambda: large_plan._get_historic_sales_bulk(self.products.ids, months))
+        self.assertEqual(small_count, large_count)
+
+    def test_action_to_forecast_query_count(self):
+        warmup_plan = self._create_plan(self.products[:2])
+        warmup_plan.action_to_forecast()
+
+        small_plan = self._create_plan(self.products[:2])
+        large_plan = self._create_plan(self.products)
+        small_count = self._count_queries(small_plan.action_to_forecast)
+        large_count = self._count_queries(large_plan.action_to_forecast)
+
+        # Seul le nombre de lots d'insertion des lignes de prévision peut varier
+        months = len(large_plan._get_months_in_period())
+        extra_batches = (math.ceil(len(self.products) * months / INSERT_BATCH_SIZE)
+                         - math.ceil(2 * months / INSERT_BATCH_SIZE))
+        self.assertEqual(len(large_plan.line_ids), len(self.products) * months)
+        self.assertLessEqual(large_count, small_count + extra_batches)
+
+    def test_historic_sales_other_company(self):
+        other_company = self.env['res.company'].create({'name': 'Autre société'})
+        self.env['replen.plan.sales.history'].create({
+            'product_id': self.products[0].id,
+            'company_id': other_company.id,
+            'date': date(self.next_year - 1, 1, 1),
+            'qty_delivered': 100.0,
+        })
+        plan = self._create_plan(self.products[:1])
+        january = date(self.next_year, 1, 1)
+        historic = plan._get_historic_sales_bulk(self.products[:1].ids, [january])
+        self.assertAlmostEqual(historic[(self.products[0].id, january)], 5.0)
+
+        self.env.user.company_ids |= other_company
+        historic = plan.with_context(allowed_company_ids=[self.env.company.id, other_company.id])\
+            ._get_historic_sales_bulk(self.products[:1].ids, [january])
+        self.assertAlmostEqual(historic[(self.products[0].id, january)], 105.0)
@@ -0,0 +1,58 @@
+from odoo.tests.common import TransactionCase, tagged
+from odoo import fields
+from datetime import date, timedelta
+
+
+@tagged('post_install', '-at_install')
+class TestReleaseSchedule(TransactionCase):
+    """Les dates de lancement suivent les lignes fournisseur modifiées en phase de rapport"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestReleaseSchedule, cls).setUpClass()
+        cls.fast_supplier, cls.slow_supplier = cls.env['res.partner'].create([
+            {'name': 'Fournisseur rapide'},
+            {'name': 'Fournisseur lent'},
+        ])
+        cls.product = cls.env['product.product'].create({'name': 'Composant planifié', 'type': 'product'})
+        cls.env['product.supplierinfo'].create([{
+            'name': supplier.id,
+            'product_tmpl_id': cls.product.product_tmpl_id.id,
+            'price': 1.0,
+            'delay': delay,
+        } for supplier, delay in ((cls.fast_supplier, 5), (cls.slow_supplier, 40))])
+
+        cls.month = date(fields.Date.today().year + 1, 1, 1)
+        plan = cls.env['replen.plan'].create({
+            'period_type': 'annual',
+            'sub_period_annual': str(cls.month.year),
+        })
+        cls.component = cls.env['replen.plan.component'].create({
+            'plan_id': plan.id,
+            'product_id': cls.product.id,
+            'date': cls.month,
+            'forecast_consumption': 12.0,
+            'quantity_to_supply': 12.0,
+        })
+        plan.write({'state': 'report'})
+        cls.component._schedule_releases()
+
+    def test_release_date_follows_supplier_lines(self):
+        fast_line, slow_line = self.component.supplier_line_ids.sorted('id')
+        self.assertEqual(self.component.release_date, self.month - timedelta(days=5))
+
+        # Suppression du fournisseur retenu : le suivant devient le fournisseur de référence
+        fast_line.unlink()
+        self.assertEqual(self.component.release_date, self.month - timedelta(days=40))
+
+        slow_line.delivery_lead_time = 20
+        self.assertEqual(self.component.release_date, self.month - timedelta(days=20))
+
+        self.env['replen.plan.supplier.line'].create({
+            'component_id': self.component.id,
+            'supplier_id': self.fast_supplier.id,
+            'price': 1.0,
+            'delivery_lead_time': 2,
+        })
+        # Le fournisseur retenu reste la première ligne créée
+        self.assertEqual(self.component.release_date, self.month - timedelta(days=20))
@@ -0,0 +1,116 @@
+from odoo.tests.common import TransactionCase, tagged
+from odoo import fields
+from datetime import date
+
+
+@tagged('post_install', '-at_install')
+class TestReplenPlanJob(TransactionCase):
+    """Reprise des plans après un traitement en arrière-plan interrompu"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestReplenPlanJob, cls).setUpClass()
+        cls.supplier_a, cls.supplier_b = cls.env['res.partner'].create([
+            {'name': 'Fournisseur A'},
+            {'name': 'Fournisseur B'},
+        ])
+        cls.component_a, cls.component_b = cls.env['product.product'].create([
+            {'name': 'Composant A', 'type': 'product'},
+            {'name': 'Composant B', 'type': 'product'},
+        ])
+        cls.env['product.supplierinfo'].create([{
+            'name': supplier.id,
+            'product_tmpl_id': component.product_tmpl_id.id,
+            'price': 10.0,
+            'delay': 5,
+        } for supplier, component in ((cls.supplier_a, cls.component_a), (cls.supplier_b, cls.component_b))])
+
+        next_year = fields.Date.today().year + 1
+        cls.plan = cls.env['replen.plan'].create({
+            'period_type': 'annual',
+            'sub_period_annual': str(next_year),
+        })
+        # Les lignes fournisseur sont créées à partir des fiches fournisseurs des composants
+        cls.env['replen.plan.component'].create([{
+            'plan_id': cls.plan.id,
+            'product_id': component.id,
+            'date': date(next_year, 1, 1),
+            'forecast_consumption': 12.0,
+            'quantity_to_supply': 12.0,
+        } for component in (cls.component_a, cls.component_b)])
+        cls.plan.write({'state': 'report'})
+
+    def test_rerun_after_cancelled_rfq_job(self):
+        # Traitement en arrière-plan dont seul le premier lot (un fournisseur) aboutit
+        self.plan.run_mode = 'async'
+        self.plan.action_generate_rfq()
+        job = self.plan.job_id
+        self.assertEqual(job.job_type, 'rfq')
+        job.chunk_size = 1
+        job._prepare_chunks()
+        first_chunk, second_chunk = job.chunk_ids.sorted('sequence')
+        self.assertTrue(first_chunk._run())
+        second_chunk.write({'state': 'failed', 'error': 'Lot interrompu'})
+        job.write({'state': 'failed'})
+        self.assertEqual(len(self.plan.purchase_order_ids), 1)
+
+        job.action_cancel()
+        self.assertEqual(job.state, 'cancelled')
+        self.assertEqual(self.plan.state, 'report')
+
+        # Reprise manuelle : seul le fournisseur manquant reçoit une demande de prix
+        self.plan.run_mode = 'sync'
+        self.plan.action_generate_rfq()
+        self.assertEqual(self.plan.state, 'done')
+        purchase_orders = self.plan.purchase_order_ids
+        self.assertEqual(len(purchase_orders), 2)
+        self.assertEqual(purchase_orders.mapped('partner_id'), self.supplier_a | self.supplier_b)
+
+        tracking = self.env['replen.plan.tracking'].search([('replen_plan_id', '=', self.plan.id)])
+        self.assertEqual(len(tracking), 1)
+        tracking_lines = self.env['replen.plan.tracking.line'].search([('tracking_id', '=', tracking.id)])
+        self.assertEqual(tracking_lines.mapped('purchase_order_line_ids.order_id'), purchase_orders)
+        self.assertEqual(sorted(tracking_lines.mapped('quantity_to_supply')), [12.0, 12.0])
+
+    def test_cancel_queued_and_stalled_jobs(self):
+        self.plan.run_mode = 'async'
+        self.plan.action_generate_rfq()
+        job = self.plan.job_id
+        self.assertEqual(job.state, 'queued')
+        self.assertTrue(job.can_cancel)
+        job.action_cancel()
+        self.assertEqual(job.state, 'cancelled')
+
+        # Un traitement en cours qui avance encore ne peut pas être annulé
+        self.plan.action_generate_rfq()
+        job = self.plan.job_id
+        job.write({'state': 'running', 'date_started': fields.Datetime.now()})
+        job.action_cancel()
+        self.assertEqual(job.state, 'running')
+
+        # Sans avancement depuis plus longtemps que le délai, il est considéré comme bloqué
+        job.flush()
+        self.env.cr.execute(
+            "UPDATE replen_plan_job SET date_started = %s, write_date = %s WHERE id = %s",
+            ('2000-01-01 00:00:00', '2000-01-01 00:00:00', job.id))
+        job.invalidate_cache()
+        self.assertTrue(job.can_cancel)
+        job.action_cancel()
+        self.assertEqual(job.state, 'cancelled')
+        self.plan._check_no_pending_job()
+
+    def test_async_incremental_regeneration(self):
+        self.plan.write({'state': 'plan', 'run_mode': 'async'})
+        components = self.plan.component_ids
+        self.plan._generate_plan()
+        job = self.plan.job_id
+        self.assertEqual(job.job_type, 'regenerate')
+        self.assertEqual(job.state, 'queued')
+
+        job._prepare_chunks()
+        self.assertEqual(len(job.chunk_ids), 1)
+        self.assertTrue(job.chunk_ids._run())
+        job._finalize()
+        # Mise à jour sur place : les composants existants sont conservés
+        self.assertEqual(self.plan.component_ids, components)
+        self.assertEqual(self.plan.state, 'plan')
@@ -0,0 +1,56 @@
+from odoo.tests.common import TransactionCase, tagged
+from odoo import fields
+from .test_generation_engines import create_bom
+import xmlrpc.client
+
+
+@tagged('post_install', '-at_install')
+class TestSimulation(TransactionCase):
+    """Les résultats de simulation peuvent être renvoyés aux appelants XML-RPC"""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestSimulation, cls).setUpClass()
+        cls.supplier = cls.env['res.partner'].create({'name': 'Fournisseur simulation'})
+        cls.finished, cls.component = cls.env['product.product'].create([
+            {'name': 'Produit fini simulé', 'type': 'product'},
+            {'name': 'Composant simulé', 'type': 'product'},
+        ])
+        create_bom(cls.env, cls.finished, [(cls.component, 3.0)])
+        cls.env['product.supplierinfo'].create({
+            'name': cls.supplier.id,
+            'product_tmpl_id': cls.component.product_tmpl_id.id,
+            'price': 2.0,
+            'delay': 10,
+        })
+        cls.plan = cls.env['replen.plan'].create({
+            'period_type': 'annual',
+            'sub_period_annual': str(fields.Date.today().year + 1),
+            'product_ids': [(6, 0, cls.finished.ids)],
+        })
+        cls.env['replen.plan.line'].create([{
+            'plan_id': cls.plan.id,
+            'product_id': cls.finished.id,
+            'date': month,
+            'forecast_qty': 10.0,
+        } for month in cls.plan._get_months_in_period()])
+
+    def test_simulation_xmlrpc_round_trip(self):
+        # Les scénarios reçus par RPC ont des clés de type chaîne
+        scenarios = [
+            {'name': 'Référence'},
+            {'name': 'Hausse', 'demand_factor': 1.5, 'component_delays': {str(self.component.id): 30}},
+        ]
+        params, method = xmlrpc.client.loads(xmlrpc.client.dumps((scenarios,)))
+        results = self.plan.simulate_scenarios(params[0])
+
+        payload = xmlrpc.client.dumps((results,), methodresponse=True)
+        (returned,), method = xmlrpc.client.loads(payload)
+        self.assertEqual(len(returned), 2)
+        reference, increase = returned
+        self.assertEqual([line['product_id'] for line in reference['components']], [self.component.id])
+        months = len(self.plan._get_months_in_period())
+        self.assertAlmostEqual(reference['components'][0]['quantity_to_supply'], 30.0 * months)
+        self.assertAlmostEqual(increase['components'][0]['quantity_to_supply'], 45.0 * months)
+        self.assertAlmostEqual(increase['total_cost'], 2.0 * 45.0 * months)
+        self.assertEqual(reference['components'][0]['supplier_id'], self.supplier.id)